@@ -0,0 +1,45 @@
+"""Measures CSSParser throughput in MB/s.
+
+Run from the repository root:
+
+    $ python -m benchmarks.bench_css
+"""
+import time
+
+from giraffe.styling import CSSParser
+
+REPEAT = 5
+
+
+def synthetic_stylesheet(rules: int = 40_000) -> str:
+    rule = (
+        ".c{i} div p{{ color: #{i:06x}; font-size: {i}%; margin-top: 0.5em; }}\n"
+        "ul li.item{i} {{ padding: 4px; bad rule here; background-color: white; }}\n"
+    )
+    return "".join(rule.format(i=i) for i in range(rules))
+
+
+def throughput(content: str) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        CSSParser(content).parse()
+        best = min(best, time.perf_counter() - start)
+    return len(content.encode("utf8")) / best / 1e6
+
+
+def main():
+    with open("data/book.css") as f:
+        book = f.read()
+    sheets = {
+        "data/book.css": book,
+        "data/book.css x 50": book * 50,
+        "synthetic": synthetic_stylesheet(),
+    }
+    for name, content in sheets.items():
+        size = len(content.encode("utf8")) / 1e6
+        print(f"{name:>20}: {size:6.2f} MB, {throughput(content):6.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
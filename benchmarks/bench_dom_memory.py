@@ -0,0 +1,52 @@
+"""Measures how much memory the DOM takes per node.
+
+Run from the repository root:
+
+    $ python -m benchmarks.bench_dom_memory
+"""
+import gc
+import tracemalloc
+
+from giraffe.parser import HtmlParser
+from giraffe.styling import style
+
+ROWS = 20_000
+
+
+def document(rows: int = ROWS) -> str:
+    row = (
+        '<div class="row"><p>Row {i} has <b>bold</b> and <i>italic</i> text</p>'
+        "</div>"
+    )
+    body = "".join(row.format(i=i) for i in range(rows))
+    return f"<html><head></head><body>{body}</body></html>"
+
+
+def count_nodes(node) -> int:
+    return 1 + sum(count_nodes(child) for child in node.children)
+
+
+def measure(content: str, styled: bool):
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    dom = HtmlParser(content).parse()
+    if styled:
+        style(dom)
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count_nodes(dom), after - before
+
+
+def main():
+    content = document()
+    for styled in (False, True):
+        nodes, size = measure(content, styled)
+        label = "styled" if styled else "parsed"
+        mb, per_node = size / 1e6, size / nodes
+        print(f"{label}: {nodes} nodes, {mb:.1f} MB, {per_node:.0f} B/node")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Measures LineLayout.layout on a long paragraph, and relayout on resize.
+
+Fonts are headless by default. Pass --tk to measure with Tk's fonts instead,
+which needs a display. Run from the repository root:
+
+    $ python -m benchmarks.bench_layout [--tk]
+"""
+import argparse
+import timeit
+
+from giraffe.layout import (
+    HEADLESS_FONTS,
+    TK_FONTS,
+    DocumentLayout,
+    FontBackend,
+    LineLayout,
+)
+from giraffe.parser import Element, Text
+from giraffe.styling import style
+
+WIDTH = 800
+WORDS = 20_000
+REPEAT = 5
+PARAGRAPHS = 500
+# an interactive drag, a few pixels per frame
+DRAG = range(WIDTH, WIDTH - 120, -4)
+
+
+def paragraph(words: int = WORDS) -> Element:
+    p = Element("p")
+    p.append_child(Text(" ".join(f"word{i % 500}" for i in range(words))))
+    style(p)
+    return p
+
+
+def page(paragraphs: int = PARAGRAPHS) -> Element:
+    body = Element("body")
+    for i in range(paragraphs):
+        p = Element("p")
+        p.append_child(Text(" ".join(f"word{j}" for j in range(5 + i % 3 * 40))))
+        body.append_child(p)
+    style(body)
+    return body
+
+
+def lines(layout) -> list:
+    if isinstance(layout, LineLayout):
+        return [layout]
+    return [line for child in layout.children for line in lines(child)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tk", action="store_true", help="use Tk's fonts")
+    args = parser.parse_args()
+
+    fonts: FontBackend = HEADLESS_FONTS
+    if args.tk:
+        import tkinter
+
+        tkinter.Tk()
+        fonts = TK_FONTS
+    document = DocumentLayout(paragraph(), WIDTH, fonts=fonts)
+    document.layout()
+    line_layouts = lines(document)
+
+    def layout_lines():
+        for line in line_layouts:
+            line.layout()
+
+    best = min(timeit.repeat(layout_lines, number=1, repeat=REPEAT))
+    print(
+        f"{len(line_layouts)} lines, {WORDS} words: {best * 1e3:.1f} ms, "
+        f"{best / WORDS * 1e6:.2f} us/word"
+    )
+
+    body = page()
+    document = DocumentLayout(body, WIDTH, fonts=fonts)
+    document.layout()
+
+    def relayout():
+        for width in DRAG:
+            DocumentLayout(body, width, fonts=fonts).layout()
+
+    def resize():
+        for width in DRAG:
+            document.resize(width)
+
+    for name, fn in (("relayout", relayout), ("resize", resize)):
+        best = min(timeit.repeat(fn, number=1, repeat=REPEAT))
+        print(
+            f"{name}, {PARAGRAPHS} paragraphs: "
+            f"{best / len(DRAG) * 1e3:.2f} ms/frame"
+        )
+
+
+if __name__ == "__main__":
+    main()
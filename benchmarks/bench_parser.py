@@ -0,0 +1,50 @@
+"""Measures HtmlParser throughput in MB/s.
+
+Run from the repository root:
+
+    $ python -m benchmarks.bench_parser
+"""
+import glob
+import time
+
+from giraffe.parser import HtmlParser
+
+REPEAT = 5
+
+
+def synthetic_document(paragraphs: int = 20_000) -> str:
+    row = (
+        '<div class="row" id="r{i}"><p>Paragraph {i} with <b>bold</b>, '
+        '<a href="/page?id={i}&amp;x=1">a link</a> &lt;and&gt; some '
+        "plain text that goes on for a little while longer.</p>"
+        "<!-- row {i} --><script>if (a < {i}) {{ b(); }}</script></div>\n"
+    )
+    body = "".join(row.format(i=i) for i in range(paragraphs))
+    return f"<!doctype html><html><head><title>t</title></head><body>{body}</body></html>"
+
+
+def throughput(content: str) -> float:
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        HtmlParser(content).parse()
+        best = min(best, time.perf_counter() - start)
+    return len(content.encode("utf8")) / best / 1e6
+
+
+def main():
+    fixtures = {}
+    for path in sorted(glob.glob("data/*.html")):
+        with open(path) as f:
+            fixtures[path] = f.read()
+    # the fixtures are tiny, so parse them many times over to get a stable number
+    fixtures["data/*.html (x500)"] = "".join(fixtures.values()) * 500
+    fixtures["synthetic"] = synthetic_document()
+
+    for name, content in fixtures.items():
+        size = len(content.encode("utf8")) / 1e6
+        print(f"{name:<24} {size:8.3f} MB {throughput(content):8.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compares styling time with and without the selector index.
+
+Run from the repository root:
+
+    $ python -m benchmarks.bench_styling
+"""
+import pathlib
+import timeit
+
+from giraffe.parser import HtmlParser
+from giraffe.styling import (
+    CSSParser,
+    RuleIndex,
+    default_style_sheet,
+    merge_rules,
+    sharing_stats,
+    sort_rules,
+    style,
+)
+
+DATA = pathlib.Path("data")
+REPEAT = 5
+DEPTH = 400
+ROWS = 2_000
+
+
+def stylesheet():
+    book = CSSParser((DATA / "book.css").read_text()).parse()
+    return merge_rules(default_style_sheet(), sort_rules(book))
+
+
+def nested(depth: int = DEPTH) -> str:
+    """Deeply nested generated markup, where descendant rules walk far."""
+    item = "<p>leaf <a>link</a> <em>em</em></p><ul><li>item</li></ul>"
+    return "<div>" * depth + item * 50 + "</div>" * depth
+
+
+def rows(count: int = ROWS) -> str:
+    """Long runs of similar siblings, where styles can be shared."""
+    row = '<li><p style="color:gray">Row {i} with <a>a link</a></p></li>'
+    items = "".join(row.format(i=i) for i in range(count))
+    return f"<html><body><ul>{items}</ul></body></html>"
+
+
+def best_of(fn) -> float:
+    return min(timeit.repeat(fn, number=1, repeat=REPEAT))
+
+
+def main():
+    rules = stylesheet()
+    index = RuleIndex(rules)
+    print(f"{len(rules)} rules")
+    paths = sorted(DATA.glob("*.html"))
+    documents = [(path.name, path.read_text()) for path in paths]
+    documents.append((f"nested-{DEPTH}", nested()))
+    documents.append((f"rows-{ROWS}", rows()))
+    for name, content in documents:
+        dom = HtmlParser(content).parse()
+        linear = best_of(lambda: style(dom, rules))
+        indexed = best_of(lambda: style(dom, index))
+        print(
+            f"{name:>12}: linear {linear * 1e3:7.2f} ms, "
+            f"indexed {indexed * 1e3:7.2f} ms, {linear / indexed:4.1f}x"
+        )
+    print(f"style sharing hit rate: {sharing_stats().hit_rate:.0%}")
+
+
+if __name__ == "__main__":
+    main()
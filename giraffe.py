@@ -1,3 +1,4 @@
+import os
 import tkinter
 import tkinter.font
 
@@ -7,7 +8,7 @@ if __name__ == "__main__":
     import sys
 
     if len(sys.argv) == 2:
-        Browser().new_tab(sys.argv[1])
+        Browser(cache_dir=os.environ.get("GIRAFFE_CACHE_DIR")).new_tab(sys.argv[1])
         tkinter.mainloop()
     else:
         print("usage: giraffe <url>")
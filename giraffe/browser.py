@@ -3,9 +3,10 @@ import sys
 import tkinter
 import tkinter.font
 from tkinter import BOTH
-from typing import List
+from typing import List, Sequence
 
 from giraffe.layout import (
+    TK_FONTS,
     VSTEP,
     Command,
     DocumentLayout,
@@ -13,13 +14,32 @@ from giraffe.layout import (
     DrawOutline,
     DrawRect,
     DrawText,
+    FontBackend,
     Rect,
     get_font,
     paint_tree,
 )
-from giraffe.net import ABOUT_BLANK_HTML, URL
+from giraffe.net import (
+    ABOUT_BLANK_HTML,
+    HTTP_CACHE,
+    URL,
+    DiskCache,
+    HttpCache,
+    fetch_all,
+)
 from giraffe.parser import Element, HtmlParser, Text
-from giraffe.styling import DEFAULT_STYLE_SHEET, CSSParser, style
+from giraffe.styling import (
+    STYLESHEET_CACHE,
+    Rule,
+    RuleIndex,
+    default_rule_index,
+    default_style_sheet,
+    invalidate_style,
+    merge_rules,
+    restyle,
+    sort_rules,
+    style,
+)
 
 """An implementation of browser gui code for displaying web pages.
 
@@ -36,6 +56,8 @@ SCROLLBAR_WIDTH = 12
 SCROLLBAR_PAD = 4
 SCROLLBAR_COLOR = "cornflower blue"
 TAG_SCROLLBAR = "gBar"
+# resizes are coalesced into at most one relayout per frame
+RESIZE_DELAY_MS = 16
 
 
 class FakeEvent:
@@ -43,11 +65,14 @@ class FakeEvent:
 
 
 class Browser:
-    def __init__(self):
+    def __init__(self, cache_dir: str | None = None):
         self.tabs: List["Tab"] = []
         self._active_tab: "Tab | None" = None
         self.width = WIDTH
         self.height = HEIGHT
+        disk = DiskCache(cache_dir) if cache_dir else None
+        self.cache = HttpCache(disk=disk)
+        self._pending_resize: str | None = None
         self.window = tkinter.Tk()
         self.canvas = tkinter.Canvas(
             self.window, width=self.width, height=self.height, bg="white"
@@ -60,6 +85,7 @@ class Browser:
         self.window.bind(sequence="<Button-1>", func=self.handle_click)
         self.window.bind(sequence="<Key>", func=self.handle_key)
         self.window.bind(sequence="<Return>", func=self.handle_enter)
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
         self.chrome = Chrome(self)
 
     @property
@@ -77,6 +103,7 @@ class Browser:
             self.width,
             self.height - self.chrome.bottom,
             self.chrome.bottom,
+            self.cache,
         )
         new_tab.load(url)
         self.active_tab = new_tab
@@ -103,11 +130,23 @@ class Browser:
         self.draw()
 
     def handle_configure(self, e):
+        if (e.width, e.height) == (self.width, self.height):
+            return
         self.width = e.width
         self.height = e.height
+        # a drag sends a stream of these, only the last size gets laid out
+        if self._pending_resize is None:
+            self._pending_resize = self.window.after(RESIZE_DELAY_MS, self.resize)
+
+    def resize(self):
+        self._pending_resize = None
         self.active_tab.configure(self.width, self.height + self.chrome.bottom)
         self.draw()
 
+    def close(self):
+        self.cache.flush()
+        self.window.destroy()
+
     def handle_key(self, e):
         if len(e.char) == 0:
             return
@@ -281,7 +320,14 @@ class Chrome:
 
 
 class Tab:
-    def __init__(self, width: int, height: int, chrome_height: int):
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        chrome_height: int,
+        cache: HttpCache = HTTP_CACHE,
+        fonts: FontBackend = TK_FONTS,
+    ):
         self.width = width
         self.height = height
         self.chrome_height = chrome_height
@@ -290,8 +336,12 @@ class Tab:
         self.display_list: List[Command] = []
         self.nodes = HtmlParser(ABOUT_BLANK_HTML).parse()
         self.location = URL("about:blank")
-        self.rules = DEFAULT_STYLE_SHEET.copy()
+        self.rules: Sequence[Rule] = default_style_sheet()
+        self.rule_index = default_rule_index()
         self.history: List[URL] = []
+        self.cache = cache
+        self.fonts = fonts
+        self.document: DocumentLayout | None = None
 
     def load(self, to_load: str | URL):
         if isinstance(to_load, str):
@@ -305,9 +355,11 @@ class Tab:
             url = to_load
 
         self.history.append(url)
-        body = url.request()
+        parser = HtmlParser(is_viewsource=url.is_viewsource)
+        for chunk in url.stream(self.cache):
+            parser.feed(chunk)
         self.location = url
-        self.nodes = HtmlParser(body).parse(url.is_viewsource)
+        self.nodes = parser.close()
         links = [
             node.attributes["href"]
             for node in tree_to_list(self.nodes, [])
@@ -316,22 +368,37 @@ class Tab:
             and node.attributes.get("rel") == "stylesheet"
             and "href" in node.attributes
         ]
-        for link in links:
-            style_url = url.resolve(link)
-            try:
-                body = style_url.request()
-            except:
+        style_urls = [url.resolve(link) for link in links]
+        sheets = [default_style_sheet()]
+        for style_url, body in zip(style_urls, fetch_all(style_urls, self.cache)):
+            if body is None:
                 continue
-            self.rules.extend(CSSParser(body).parse())
-        self.rules = sorted(self.rules, key=lambda r: r.cascade_priority())
+            sheets.append(STYLESHEET_CACHE.parse(str(style_url), body))
+        self.rules = merge_rules(*sheets)
+        self.rule_index = RuleIndex(self.rules, is_sorted=True)
+        style(self.nodes, self.rule_index)
+        self._build_display_list()
+
+    def add_style_sheet(self, rules: Sequence[Rule]):
+        """Adds rules to the page, restyling only the elements they can match."""
+        sheet = sort_rules(rules)
+        self.rules = merge_rules(self.rules, sheet)
+        self.rule_index = RuleIndex(self.rules, is_sorted=True)
+        invalidate_style(self.nodes, sheet)
         self._build_display_list()
 
     def _build_display_list(self):
-        style(self.nodes, self.rules)
+        restyle(self.nodes, self.rule_index)
         self.document = DocumentLayout(
-            self.nodes, self.width - SCROLLBAR_WIDTH - 2 * SCROLLBAR_PAD
+            self.nodes, self._layout_width(), fonts=self.fonts
         )
         self.document.layout()
+        self._paint()
+
+    def _layout_width(self) -> int:
+        return self.width - SCROLLBAR_WIDTH - 2 * SCROLLBAR_PAD
+
+    def _paint(self):
         # display_list is standard browser/gui (?) terminology
         self.display_list = []
         paint_tree(self.document, self.display_list)
@@ -371,9 +438,19 @@ class Tab:
             canvas.create_rectangle(x1, y1, x2, y2, fill=SCROLLBAR_COLOR, tags=TAG_SCROLLBAR)
 
     def configure(self, width, height):
+        """Resizes the tab, reusing the current layout where it can.
+
+        Styles don't depend on the window size, so they're left alone. When only
+        the height changed nothing has to be laid out again.
+        """
+        resized = width != self.width
         self.width = width
         self.height = height
-        self._build_display_list()
+        if self.document is None:
+            self._build_display_list()
+        elif resized:
+            self.document.resize(self._layout_width())
+            self._paint()
 
     def scrolldown(self):
         self._handle_scroll(SCROLL_STEP)
@@ -1,10 +1,18 @@
+import abc
 import math
-import tkinter.font
+import threading
+import weakref
+from collections import OrderedDict
 from dataclasses import dataclass
 from enum import Enum
-from typing import List, Literal
+from typing import TYPE_CHECKING, Callable, Dict, List, Literal, Tuple
 
-from giraffe.parser import SOFT_HYPHEN, Element, Node, Text
+from giraffe.parser import SOFT_HYPHEN, ComputedStyle, Element, Node, Text
+from giraffe.styling import TableStats
+
+if TYPE_CHECKING:
+    import tkinter
+    import tkinter.font
 
 """The layout code used by the browser.
 
@@ -23,6 +31,114 @@ SLANT_ROMAN = "roman"
 SLANT_ITALIC = "italic"
 
 
+class Font(abc.ABC):
+    """A font, with the metrics layout needs read once when it is made.
+
+    Layout asks for a font's metrics for every word it places, which would
+    otherwise be a round trip into Tk each time.
+    """
+
+    __slots__ = ("name", "config", "ascent", "descent", "linespace")
+
+    def __init__(
+        self, name: str, config: Dict[str, "str | int"], metrics: Dict[str, int]
+    ):
+        self.name = name
+        self.config = config
+        self.ascent: int = metrics["ascent"]
+        self.descent: int = metrics["descent"]
+        self.linespace: int = metrics["linespace"]
+
+    @abc.abstractmethod
+    def measure(self, text: str) -> int:
+        """The width of `text` in pixels."""
+
+    def metrics(self, *options: str):
+        metrics = {
+            "ascent": self.ascent,
+            "descent": self.descent,
+            "linespace": self.linespace,
+        }
+        if len(options) == 1:
+            return metrics[options[0]]
+        return metrics
+
+    def __getitem__(self, option: str):
+        return self.config[option]
+
+    def __str__(self) -> str:
+        # Tk is given str(font) wherever a font is passed to a widget
+        return self.name
+
+
+class TkFont(Font):
+    __slots__ = ("font",)
+
+    def __init__(self, font: "tkinter.font.Font"):
+        super().__init__(font.name, font.config(), font.metrics())
+        self.font = font
+
+    def measure(self, text: str) -> int:
+        return self.font.measure(text)
+
+
+# Advances for the headless fonts, as a fraction of the font's pixel size.
+NARROW_GLYPHS = frozenset("fijlrtI!'()*,-./:;[]`{|}\u00ad")
+WIDE_GLYPHS = frozenset("mwMW@%")
+HEADLESS_ADVANCES = {" ": 0.28, "narrow": 0.3, "wide": 0.85, "upper": 0.68}
+HEADLESS_ADVANCE = 0.55
+MONOSPACE_ADVANCE = 0.6
+MONOSPACE_FAMILIES = frozenset(["courier", "courier new", "monospace"])
+
+
+class HeadlessFont(Font):
+    """A font with fixed, made-up metrics, so layout can run without Tk.
+
+    Widths are the sum of per-character advances, so layout is deterministic
+    whatever machine it runs on, but only roughly what Tk would draw.
+    """
+
+    __slots__ = ("_px", "_monospace", "_advances")
+
+    def __init__(self, family: str, size: int, weight: str, slant: str):
+        px = size * 4 / 3
+        ascent, descent = round(px * 0.9), round(px * 0.25)
+        super().__init__(
+            f"headless {family} {size} {weight} {slant}",
+            {"family": family, "size": size, "weight": weight, "slant": slant},
+            {"ascent": ascent, "descent": descent, "linespace": ascent + descent},
+        )
+        self._monospace = family.casefold() in MONOSPACE_FAMILIES
+        self._px = px * 1.1 if weight == WEIGHT_BOLD and not self._monospace else px
+        self._advances: Dict[str, int] = {}
+
+    def measure(self, text: str) -> int:
+        width = 0
+        for c in text:
+            advance = self._advances.get(c)
+            if advance is None:
+                advance = self._advances[c] = self._advance(c)
+            width += advance
+        return width
+
+    def _advance(self, c: str) -> int:
+        if self._monospace:
+            return round(self._px * MONOSPACE_ADVANCE)
+        return round(self._px * headless_advance(c))
+
+
+def headless_advance(c: str) -> float:
+    if c == " ":
+        return HEADLESS_ADVANCES[" "]
+    if c in NARROW_GLYPHS:
+        return HEADLESS_ADVANCES["narrow"]
+    if c in WIDE_GLYPHS:
+        return HEADLESS_ADVANCES["wide"]
+    if c.isupper():
+        return HEADLESS_ADVANCES["upper"]
+    return HEADLESS_ADVANCE
+
+
 @dataclass
 class Rect:
     left: int
@@ -36,7 +152,7 @@ class Rect:
 
 @dataclass
 class Styling:
-    font: tkinter.font.Font
+    font: Font
     color: str = "black"
     valignment: Literal["None", "Top"] = "None"
 
@@ -95,13 +211,13 @@ class DrawLine:
 @dataclass
 class DrawText(Command):
     text: str
-    font: tkinter.font.Font
+    font: Font
     color: str
 
     def __post_init__(self):
-        self.bottom = self.top + self.font.metrics("linespace")
+        self.bottom = self.top + self.font.linespace
 
-    def execute(self, scroll, canvas: tkinter.Canvas):
+    def execute(self, scroll, canvas: "tkinter.Canvas"):
         canvas.create_text(
             self.left,
             self.top - scroll,
@@ -130,9 +246,17 @@ class DrawRect(Command):
 
 
 class DocumentLayout:
-    def __init__(self, node, width: int):
+    def __init__(
+        self,
+        node,
+        width: int,
+        measurer: "MeasureCache | None" = None,
+        fonts: "FontBackend | None" = None,
+    ):
         self.node = node
         self.parent = None
+        self.measurer = MEASURE_CACHE if measurer is None else measurer
+        self.fonts = TK_FONTS if fonts is None else fonts
         self.children: "List[BlockLayout]" = []
 
         self.x = HSTEP
@@ -141,11 +265,21 @@ class DocumentLayout:
         self.height = 0
 
     def layout(self):
-        child = BlockLayout(self.node, self, None)
-        self.children.append(child)
+        if not self.children:
+            self.children.append(BlockLayout(self.node, self, None))
+        child = self.children[0]
         child.layout()
         self.height = child.height
 
+    def resize(self, width: int):
+        """Lays the document out again at a new width.
+
+        The layout tree is kept, so only blocks whose line breaks can change at
+        the new width are broken into lines again; the rest are just moved.
+        """
+        self.width = width - 2 * HSTEP
+        self.layout()
+
     def paint(self) -> List[Command]:
         return []
 
@@ -161,6 +295,8 @@ class LineLayout:
         self.parent = parent
         self.previous = previous
         self.children: List[TextLayout] = []
+        self.measurer = parent.measurer
+        self.fonts = parent.fonts
 
     def layout(self):
         self.width = self.parent.width
@@ -178,12 +314,12 @@ class LineLayout:
         if not self.children:
             self.height = 0
         else:
-            max_ascent = max([word.font.metrics("ascent") for word in self.children])
+            max_ascent = max([word.font.ascent for word in self.children])
             baseline = self.y + 1.25 * max_ascent
 
             for word in self.children:
-                word.y = baseline - word.font.metrics("ascent")
-            max_descent = max([word.font.metrics("descent") for word in self.children])
+                word.y = baseline - word.font.ascent
+            max_descent = max([word.font.descent for word in self.children])
             self.height = 1.25 * (max_ascent + max_descent)
 
     def paint(self):
@@ -205,9 +341,22 @@ class TextLayout:
         self.previous = previous
         self.x: "int | None" = None
         self.y: "int | None" = None
-        self.font: "tkinter.font.Font | None" = None
+        self.font: "Font | None" = None
+        self.measurer = parent.measurer
+        self.fonts = parent.fonts
 
     def layout(self):
+        self.font = self.fonts.style_font(self.node, "text", self._get_font)
+
+        self.width = self.measurer.measure(self.font, self.word)
+        if self.previous:
+            space = self.measurer.space_width(self.previous.font)
+            self.x = self.previous.x + space + self.previous.width
+        else:
+            self.x = self.parent.x
+        self.height = self.font.linespace
+
+    def _get_font(self) -> Font:
         weight = self.node.style["font-weight"]
         style = self.node.style["font-style"]
         size = int(float(self.node.style["font-size"][:-2]) * 0.75)
@@ -215,18 +364,10 @@ class TextLayout:
             size = math.ceil(size / 2)
 
         family = self.node.style["font-family"]
-        self.font = get_font(
+        return self.fonts.get_font(
             family, size, weight.casefold() == WEIGHT_BOLD, style != "normal"
         )
 
-        self.width = self.font.measure(self.word)
-        if self.previous:
-            space = self.previous.font.measure(" ")
-            self.x = self.previous.x + space + self.previous.width
-        else:
-            self.x = self.parent.x
-        self.height = self.font.metrics("linespace")
-
     def paint(self):
         color = self.node.style["color"]
         return [
@@ -299,6 +440,11 @@ class BlockLayout(object):
         self.parent = parent
         self.previous = previous
         self.children: List["LineLayout | BlockLayout"] = []
+        self.measurer = parent.measurer
+        self.fonts = parent.fonts
+        # widths this block's lines break the same at, see _is_overflowing
+        self.min_width = 0.0
+        self.max_width = math.inf
 
     def _is_pre(self) -> bool:
         return isinstance(self.node, Element) and self.node.tag == "pre"
@@ -326,16 +472,26 @@ class BlockLayout(object):
         return cmds
 
     def layout(self):
-        mode = self.layout_mode()
         self.x = self.parent.x
         self.width = self.parent.width
 
         if self.previous:
-            self.y = self.previous.y + self.previous.height
+            y = self.previous.y + self.previous.height
         else:
-            self.y = self.parent.y
-
-        if mode == LayoutMode.BLOCK:
+            y = self.parent.y
+
+        if self.children and self._is_inline():
+            if self.min_width <= self.width < self.max_width:
+                # relayout where every line still breaks in the same place
+                self._move(y - self.y)
+                return
+            self.children = []
+        self.y = y
+
+        if self.children:
+            # block children are kept and each decides whether to relayout
+            pass
+        elif self.layout_mode() == LayoutMode.BLOCK:
             # Reads from HTML tree and writes to the layout tree.
             previous = None
             for child in self.node.children:
@@ -343,6 +499,9 @@ class BlockLayout(object):
                 self.children.append(next)
                 previous = next
         else:
+            self.line = []
+            self.min_width = 0.0
+            self.max_width = math.inf
             self.new_line()
             self.recurse(self.node)
 
@@ -351,6 +510,17 @@ class BlockLayout(object):
 
         self.height = sum([child.height for child in self.children])
 
+    def _is_inline(self) -> bool:
+        return isinstance(self.children[0], LineLayout)
+
+    def _move(self, dy: float):
+        self.y += dy
+        for line in self.children:
+            line.width = self.width
+            line.y += dy
+            for word in line.children:
+                word.y += dy
+
     def layout_mode(self) -> LayoutMode:
         if isinstance(self.node, Text):
             return LayoutMode.INLINE
@@ -391,8 +561,9 @@ class BlockLayout(object):
                 self.recurse(child)
 
     def _handle_text(self, node: Node, word: str):
-        if not self._is_overflowing(node, word) or SOFT_HYPHEN not in word:
-            self.word(node, word)
+        overflowing = self._is_overflowing(node, word)
+        if not overflowing or SOFT_HYPHEN not in word:
+            self.word(node, word, overflowing)
             return
 
         # too long and contains a soft hyphen, try to split word on hyphen
@@ -411,8 +582,11 @@ class BlockLayout(object):
             word = word[:hyph_idx]
         return hyph_idx
 
-    def word(self, node: Node, word: str):
-        if self._is_overflowing(node, word):
+    def word(self, node: Node, word: str, overflowing: "bool | None" = None):
+        # asking again could give a different answer if the first was exact
+        if overflowing is None:
+            overflowing = self._is_overflowing(node, word)
+        if overflowing:
             self.new_line()
         line = self.children[-1]
         previous_word = line.children[-1] if line.children else None
@@ -423,23 +597,58 @@ class BlockLayout(object):
             word = word.upper()
 
         font = self._get_font(node)
-        word_len = font.measure(word)
+        word_len = self.measurer.measure(font, word)
         color = node.style["color"]
         style = Styling(font, color)
         if is_sup(node.parent):
             style.valignment = "Top"
         self.line.append(LineUnit(self.cursor_x, word, style))
         if not self._is_pre():
-            self.cursor_x += word_len + font.measure(" ")
+            self.cursor_x += word_len + self.measurer.space_width(font)
         else:
             self.cursor_x += word_len
+        # remembered in case cursor_x is approximate and has to be synced
+        spaced = not self._is_pre()
+        self.line_words.append((font, word, spaced))
+        self.line_slack += self.measurer.slack(font, len(word) + spaced)
 
     def _is_overflowing(self, node: Node, word: str) -> bool:
         font = self._get_font(node)
-        word_len = font.measure(word)
-        return self.cursor_x + word_len > self.width
+        word_len = self.measurer.measure(font, word)
+        slack = self.line_slack + self.measurer.slack(font, len(word))
+        if slack and abs(self.cursor_x + word_len - self.width) <= slack:
+            self._sync_cursor()
+            word_len = self.measurer.measure_exact(font, word)
+            slack = 0
+        # Every line break depends on answers given here, so a width that
+        # answers them all the same way gets the same lines.
+        extent = self.cursor_x + word_len
+        if extent > self.width:
+            self.max_width = min(self.max_width, extent - slack)
+            return True
+        self.min_width = max(self.min_width, extent + slack)
+        return False
+
+    def _sync_cursor(self):
+        """Replaces an approximate cursor_x with an exact one.
+
+        Words are measured one at a time, as they are placed, so the cursor
+        ends up where exact measurement would have put it.
+        """
+        x = self.line_start
+        for font, word, spaced in self.line_words:
+            x += self.measurer.measure_exact(font, word)
+            if spaced:
+                x += self.measurer.space_width(font)
+        self.cursor_x = self.line_start = x
+        self.line_words = []
+        self.line_slack = 0.0
 
     def _get_font(self, node: Node):
+        kind = "pre" if self._is_pre() else "block"
+        return self.fonts.style_font(node, kind, lambda: self._resolve_font(node))
+
+    def _resolve_font(self, node: Node):
         if self._is_pre():
             family = "Courier New"
         else:
@@ -462,7 +671,7 @@ class BlockLayout(object):
         if is_sup(node.parent):
             size = math.ceil(size / 2)
 
-        font = get_font(
+        font = self.fonts.get_font(
             family,
             size,
             weight.casefold() == WEIGHT_BOLD,
@@ -473,6 +682,10 @@ class BlockLayout(object):
 
     def new_line(self):
         self.cursor_x = 0
+        self.line_start = 0
+        self.line_words: List[Tuple[Font, str, bool]] = []
+        # how far cursor_x may be from the exact width of the line
+        self.line_slack = 0.0
         last_line = self.children[-1] if self.children else None
         new_line = LineLayout(self.node, self, last_line)
         self.children.append(new_line)
@@ -508,20 +721,209 @@ def is_sup(parent: Node) -> bool:
     return isinstance(parent, Element) and parent.tag == "sup"
 
 
-FONTS = {}
+class FontBackend(abc.ABC):
+    """Where layout gets its fonts from.
 
+    Fonts are made once per family, size, weight and slant. The backend also
+    remembers which font each interned computed style resolved to, weakly, so
+    styles are still freed once no node uses them.
+    """
+
+    def __init__(self):
+        self.fonts: Dict[Tuple[str, int, str, str], Font] = {}
+        # The font also depends on the kind of layout asking for it, and on
+        # the parent's tag (b, i, abbr, sup).
+        self.style_fonts: "weakref.WeakKeyDictionary[ComputedStyle, Dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def style_font(self, node: Node, kind: str, resolve: Callable[[], Font]) -> Font:
+        """Returns the font for `node`'s style, resolving it on a miss."""
+        style = node.style
+        if not isinstance(style, ComputedStyle):
+            return resolve()
+        parent = node.parent
+        key = (kind, parent.tag if isinstance(parent, Element) else None)
+        fonts = self.style_fonts.get(style)
+        if fonts is None:
+            fonts = self.style_fonts.setdefault(style, {})
+        font = fonts.get(key)
+        if font is None:
+            font = fonts[key] = resolve()
+        return font
+
+    def get_font(self, family: str, size: int, is_bold: bool, is_italic: bool) -> Font:
+        weight = WEIGHT_BOLD if is_bold else WEIGHT_NORMAL
+        slant = SLANT_ITALIC if is_italic else SLANT_ROMAN
+        key = (family, size, weight, slant)
+        font = self.fonts.get(key)
+        if font is None:
+            font = self.fonts[key] = self._make_font(family, size, weight, slant)
+        return font
+
+    @abc.abstractmethod
+    def _make_font(self, family: str, size: int, weight: str, slant: str) -> Font:
+        """Makes the font, which is kept for as long as the backend is."""
+
+
+class TkFontBackend(FontBackend):
+    """Fonts from Tk, which needs a display and a Tk root window."""
+
+    def __init__(self):
+        super().__init__()
+        self._labels: List["tkinter.Label"] = []
+
+    def _make_font(self, family: str, size: int, weight: str, slant: str) -> Font:
+        import tkinter
+        import tkinter.font
 
-def get_font(
-    family: str, size: int, is_bold: bool, is_italic: bool
-) -> tkinter.font.Font:
-    weight = WEIGHT_BOLD if is_bold else WEIGHT_NORMAL
-    slant = SLANT_ITALIC if is_italic else SLANT_ROMAN
-    key = (family, size, weight, slant)
-    if key not in FONTS:
         font = tkinter.font.Font(family=family, size=size, weight=weight, slant=slant)
-        label = tkinter.Label(font=font)
-        FONTS[key] = (font, label)
-    return FONTS[key][0]
+        # XXX: keeps the font alive in Tk for as long as the backend is
+        self._labels.append(tkinter.Label(font=font))
+        return TkFont(font)
+
+
+class HeadlessFontBackend(FontBackend):
+    """Fonts with fixed metrics, for laying out pages without a display."""
+
+    def _make_font(self, family: str, size: int, weight: str, slant: str) -> Font:
+        return HeadlessFont(family, size, weight, slant)
+
+
+TK_FONTS = TkFontBackend()
+HEADLESS_FONTS = HeadlessFontBackend()
+
+
+def get_font(family: str, size: int, is_bold: bool, is_italic: bool) -> Font:
+    return TK_FONTS.get_font(family, size, is_bold, is_italic)
+
+
+DEFAULT_MEASURE_ENTRIES = 64 * 1024
+
+
+class MeasureCache:
+    """Caches text measurements, which are each a round trip into Tk.
+
+    Widths are keyed by the font's name and the string, and evicted least
+    recently used first. The width of a space never changes for a font, so it
+    is kept for as long as the font is. One cache is shared by every layout,
+    so it can be used from several threads at once.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MEASURE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._widths: OrderedDict[Tuple[str, str], int] = OrderedDict()
+        self._spaces: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def measure(self, font: Font, text: str) -> int:
+        key = (font.name, text)
+        with self._lock:
+            width = self._widths.get(key)
+            if width is not None:
+                self._widths.move_to_end(key)
+                self.hits += 1
+                return width
+            self.misses += 1
+        width = font.measure(text)
+        with self._lock:
+            self._widths[key] = width
+            if len(self._widths) > self.max_entries:
+                self._widths.popitem(last=False)
+        return width
+
+    def space_width(self, font: Font) -> int:
+        width = self._spaces.get(font.name)
+        if width is None:
+            width = self._spaces[font.name] = font.measure(" ")
+        return width
+
+    def measure_exact(self, font: Font, text: str) -> int:
+        return self.measure(font, text)
+
+    def slack(self, font: Font, chars: int) -> float:
+        """How far off measuring `chars` characters may be; exact here."""
+        return 0
+
+    def clear(self):
+        with self._lock:
+            self._widths.clear()
+            self._spaces.clear()
+
+    def stats(self) -> TableStats:
+        with self._lock:
+            return TableStats(self.hits, self.misses, len(self._widths))
+
+
+MEASURE_CACHE = MeasureCache()
+
+# Pairs that fonts commonly kern, or draw as a ligature. How far measuring one
+# of these is from the sum of its advances bounds a font's kerning.
+KERNING_PAIRS = (
+    "AV AW AY AT LT LV LW LY PA TA Ta Te To Tr Ty VA Va Ve Vo WA Wa We Wo "
+    "YA Ya Ye Yo av aw ay ff fi fl r. r, y. y, f. f,"
+).split()
+# Long enough that advances rounded to whole pixels drift from the exact width.
+CALIBRATION_TEXT = "The quick brown fox jumps over the lazy dog, 0123456789 TIMES."
+
+
+class GlyphMeasurer(MeasureCache):
+    """Approximates widths by summing the advance of each character.
+
+    A font's advance table fills in one character at a time, so laying out a
+    page takes about one Tk call per distinct character and font, however many
+    distinct words it has. Sums ignore kerning and rounding, so when a word ends
+    close to the edge of a line, BlockLayout measures the line exactly before
+    deciding where to break.
+
+    How close is close is measured for each font: the largest difference
+    between a kerning pair and the sum of its advances, plus the drift from
+    rounding per character of a longer text, allowed for each character laid
+    out since the line was last measured exactly.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MEASURE_ENTRIES):
+        super().__init__(max_entries)
+        self._advances: Dict[str, Dict[str, int]] = {}
+        self._slacks: Dict[str, float] = {}
+
+    def measure(self, font: Font, text: str) -> int:
+        advances = self._advances.get(font.name)
+        if advances is None:
+            advances = self._advances[font.name] = {}
+        try:
+            return sum(map(advances.__getitem__, text))
+        except KeyError:
+            for c in text:
+                if c not in advances:
+                    advances[c] = font.measure(c)
+            return sum(map(advances.__getitem__, text))
+
+    def measure_exact(self, font: Font, text: str) -> int:
+        return super().measure(font, text)
+
+    def slack(self, font: Font, chars: int) -> float:
+        slack = self._slacks.get(font.name)
+        if slack is None:
+            slack = self._slacks[font.name] = self._measure_slack(font)
+        return slack * chars
+
+    def _measure_slack(self, font: Font) -> float:
+        kerning = max(
+            abs(self.measure(font, pair) - font.measure(pair))
+            for pair in KERNING_PAIRS
+        )
+        text = CALIBRATION_TEXT
+        # plus a pixel, as the exact width is itself rounded
+        drift = (abs(self.measure(font, text) - font.measure(text)) + 1) / len(text)
+        return kerning + drift
+
+    def clear(self):
+        super().clear()
+        self._advances.clear()
+        self._slacks.clear()
 
 
 def paint_tree(
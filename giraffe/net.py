@@ -1,11 +1,34 @@
-import gzip
+import abc
+import asyncio
+import codecs
+import concurrent.futures
+import hashlib
+import json
+import os
+import select
 import socket
 import ssl
+import sys
+import threading
 import time
+import weakref
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
 from enum import Enum
-from io import BytesIO
-from typing import IO, Mapping
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Mapping,
+    Set,
+    Tuple,
+)
 
 """An implementation of network code for fetching web pages.
 
@@ -31,6 +54,769 @@ DEFAULT_PORTS = {Scheme.HTTP: 80, Scheme.HTTPS: 443}
 
 MAX_CHUNK = 16 * 1024
 
+MAX_SOCKETS_PER_HOST = 6
+IDLE_TIMEOUT_SECS = 30.0
+
+MAX_FETCH_WORKERS = 8
+RESOURCE_TIMEOUT_SECS = 10.0
+RESOURCE_BUDGET_SECS = 30.0
+
+PoolKey = Tuple[Scheme, str, int]
+
+
+@dataclass
+class PoolStats:
+    hits: int = 0
+    misses: int = 0
+    open_sockets: int = 0
+
+
+class _Pool(abc.ABC):
+    """The bookkeeping shared by ConnectionPool and AsyncConnectionPool.
+
+    Connections are counted against their key from when they are reserved
+    until they are closed, and are kept idle between uses for at most
+    `idle_timeout` seconds. Subclasses say how to check and close one.
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = MAX_SOCKETS_PER_HOST,
+        idle_timeout: float = IDLE_TIMEOUT_SECS,
+    ):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self._idle: Dict[PoolKey, List[Tuple[Any, float]]] = {}
+        self._open: Dict[PoolKey, int] = {}
+
+    @abc.abstractmethod
+    def _is_usable(self, conn) -> bool:
+        """Whether an idle connection can still be used."""
+
+    @abc.abstractmethod
+    def _close_connection(self, conn):
+        pass
+
+    def _reuse(self, key: PoolKey):
+        """Returns an idle connection for `key`, or None if there isn't one."""
+        self._evict_expired()
+        idle = self._idle.get(key, [])
+        while idle:
+            conn, _ = idle.pop()
+            if self._is_usable(conn):
+                self.hits += 1
+                return conn
+            self._close(key, conn)
+        return None
+
+    def _reserve(self, key: PoolKey) -> bool:
+        """Counts a new connection against `key`, if it has room for one."""
+        if self._open.get(key, 0) >= self.max_per_host:
+            return False
+        self._open[key] = self._open.get(key, 0) + 1
+        self.misses += 1
+        return True
+
+    def _unreserve(self, key: PoolKey):
+        self._open[key] -= 1
+        if not self._open[key]:
+            del self._open[key]
+
+    def _release(self, key: PoolKey, conn, reuse: bool):
+        if reuse and self._is_usable(conn):
+            self._idle.setdefault(key, []).append((conn, time.monotonic()))
+        else:
+            self._close(key, conn)
+
+    def _clear(self):
+        for key, idle in self._idle.items():
+            for conn, _ in idle:
+                self._close(key, conn)
+        self._idle.clear()
+
+    def _stats(self) -> PoolStats:
+        return PoolStats(self.hits, self.misses, sum(self._open.values()))
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key, idle in self._idle.items():
+            expired = [c for c, last in idle if now - last > self.idle_timeout]
+            if expired:
+                idle[:] = [(c, last) for c, last in idle if c not in expired]
+                for conn in expired:
+                    self._close(key, conn)
+
+    def _close(self, key: PoolKey, conn):
+        self._close_connection(conn)
+        self._unreserve(key)
+
+
+class ConnectionPool(_Pool):
+    """A process-wide pool of keep-alive sockets keyed by (scheme, host, port).
+
+    At most `max_per_host` sockets are open for a key at once; callers asking
+    for more block until one is released. Idle sockets are closed once they
+    have sat unused for longer than `idle_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = MAX_SOCKETS_PER_HOST,
+        idle_timeout: float = IDLE_TIMEOUT_SECS,
+    ):
+        super().__init__(max_per_host, idle_timeout)
+        self._available = threading.Condition()
+
+    def acquire(
+        self, key: PoolKey, timeout: float | None = None
+    ) -> Tuple[socket.socket, bool]:
+        """Returns a connected socket for `key` and whether it was reused.
+
+        `timeout` bounds both the wait for a free slot and each operation on
+        the returned socket.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._available:
+            while True:
+                s = self._reuse(key)
+                if s is not None:
+                    s.settimeout(timeout)
+                    return s, True
+                if self._reserve(key):
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"no free socket for {key[1]}:{key[2]}")
+                self._available.wait(remaining)
+
+        try:
+            return _connect(key, timeout), False
+        except BaseException:
+            with self._available:
+                self._unreserve(key)
+                self._available.notify()
+            raise
+
+    def release(self, key: PoolKey, s: socket.socket, reuse: bool = True):
+        with self._available:
+            self._release(key, s, reuse)
+            self._available.notify()
+
+    def clear(self):
+        with self._available:
+            self._clear()
+            self._available.notify_all()
+
+    def stats(self) -> PoolStats:
+        with self._available:
+            return self._stats()
+
+    def _is_usable(self, s: socket.socket) -> bool:
+        return _is_alive(s)
+
+    def _close_connection(self, s: socket.socket):
+        s.close()
+
+
+def _connect(key: PoolKey, timeout: float | None = None) -> socket.socket:
+    scheme, host, port = key
+    s = socket.socket(
+        family=socket.AF_INET, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP
+    )
+    s.settimeout(timeout)
+    if scheme == Scheme.HTTPS:
+        ctx = ssl.create_default_context()
+        s = ctx.wrap_socket(s, server_hostname=host)
+    try:
+        s.connect((host, port))
+    except BaseException:
+        s.close()
+        raise
+    return s
+
+
+def _is_alive(s: socket.socket) -> bool:
+    """An idle keep-alive socket should have nothing to read.
+
+    If it is readable the server has either closed it or sent something we
+    did not ask for, and in both cases it can't be reused.
+    """
+    if s.fileno() == -1:
+        return False
+    try:
+        readable, _, _ = select.select([s], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+POOL = ConnectionPool()
+
+
+Stream = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class AsyncConnectionPool(_Pool):
+    """The asyncio counterpart to ConnectionPool.
+
+    Streams belong to the event loop that opened them, so there is one pool
+    per running loop, see `async_pool()`.
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = MAX_SOCKETS_PER_HOST,
+        idle_timeout: float = IDLE_TIMEOUT_SECS,
+    ):
+        super().__init__(max_per_host, idle_timeout)
+        self._slots: Dict[PoolKey, asyncio.Semaphore] = {}
+
+    async def acquire(self, key: PoolKey) -> Tuple[Stream, bool]:
+        """Returns connected streams for `key` and whether they were reused."""
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = asyncio.Semaphore(self.max_per_host)
+        await slots.acquire()
+        stream = self._reuse(key)
+        if stream is not None:
+            return stream, True
+
+        # the semaphore already bounds the streams open for a key
+        self._reserve(key)
+        try:
+            stream = await _open_connection(key)
+        except BaseException:
+            self._unreserve(key)
+            slots.release()
+            raise
+        return stream, False
+
+    def release(self, key: PoolKey, stream: Stream, reuse: bool = True):
+        self._release(key, stream, reuse)
+        self._slots[key].release()
+
+    def clear(self):
+        self._clear()
+
+    def stats(self) -> PoolStats:
+        return self._stats()
+
+    def _is_usable(self, stream: Stream) -> bool:
+        reader, writer = stream
+        return not reader.at_eof() and not writer.is_closing()
+
+    def _close_connection(self, stream: Stream):
+        stream[1].close()
+
+
+async def _open_connection(key: PoolKey) -> Stream:
+    scheme, host, port = key
+    ctx = ssl.create_default_context() if scheme == Scheme.HTTPS else None
+    return await asyncio.open_connection(host, port, ssl=ctx)
+
+
+# keyed by event loop
+_ASYNC_POOLS: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def async_pool() -> AsyncConnectionPool:
+    """Returns the connection pool for the running event loop."""
+    loop = asyncio.get_running_loop()
+    pool = _ASYNC_POOLS.get(loop)
+    if pool is None:
+        pool = _ASYNC_POOLS[loop] = AsyncConnectionPool()
+    return pool
+
+
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+DEFAULT_DISK_CACHE_BYTES = 256 * 1024 * 1024
+# Changes appended to the disk cache's journal before the index is rewritten.
+MAX_JOURNAL_ENTRIES = 256
+# Entries read before their last access times are journaled.
+MAX_PENDING_ACCESSES = 32
+CACHEABLE_STATUSES = ("200", "301")
+BODYLESS_STATUSES = ("204", "304")
+# Headers describing the stored body itself, which a 304 must not replace.
+NOT_MODIFIED_SKIP_HEADERS = ("content-length", "content-encoding", "transfer-encoding")
+MAX_REDIRECTS = 10
+
+
+def parse_cache_control(value: str) -> Dict[str, str]:
+    directives = {}
+    for directive in value.split(","):
+        name, _, arg = directive.partition("=")
+        name = name.strip().casefold()
+        if name:
+            directives[name] = arg.strip().strip('"')
+    return directives
+
+
+def _parse_http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class CacheEntry:
+    """A stored response along with the bookkeeping to compute its age.
+
+    Age and freshness follow the calculations in RFC 9111 section 4.2.
+    """
+
+    response: Response
+    request_time: float
+    response_time: float
+    size: int
+
+    @property
+    def directives(self) -> Dict[str, str]:
+        return parse_cache_control(self.response.headers.get("cache-control", ""))
+
+    def freshness_lifetime(self) -> float:
+        directives = self.directives
+        if "max-age" in directives:
+            try:
+                return max(0, int(directives["max-age"]))
+            except ValueError:
+                return 0
+        expires = _parse_http_date(self.response.headers.get("expires"))
+        if expires is None:
+            return 0
+        date = _parse_http_date(self.response.headers.get("date"))
+        return max(0, expires - (date or self.response_time))
+
+    def current_age(self, now: float) -> float:
+        date = _parse_http_date(self.response.headers.get("date"))
+        apparent_age = max(0, self.response_time - date) if date else 0
+        try:
+            age_value = int(self.response.headers.get("age", "0"))
+        except ValueError:
+            age_value = 0
+        response_delay = self.response_time - self.request_time
+        corrected_initial_age = max(apparent_age, age_value + response_delay)
+        return corrected_initial_age + (now - self.response_time)
+
+    def is_fresh(self, now: float) -> bool:
+        if "no-cache" in self.directives:
+            return False
+        return self.freshness_lifetime() > self.current_age(now)
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if "etag" in self.response.headers:
+            headers["If-None-Match"] = self.response.headers["etag"]
+        if "last-modified" in self.response.headers:
+            headers["If-Modified-Since"] = self.response.headers["last-modified"]
+        return headers
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+    size: int = 0
+    disk_hits: int = 0
+    revalidations: int = 0
+
+
+class DiskCache:
+    """A persistent cache layer kept in a directory.
+
+    An index file maps each key to its response metadata, and each body is
+    stored in its own blob file. Blobs are only read once the index says the
+    entry is still fresh, so stale or unused bodies are never loaded. The
+    least recently used entries are removed once the blobs exceed `max_bytes`.
+
+    Changes to the index are appended to a journal, which is replayed on load
+    and folded back into the index every `MAX_JOURNAL_ENTRIES` changes, so a
+    write doesn't cost a rewrite of the whole index.
+    """
+
+    INDEX = "index.json"
+    JOURNAL = "journal.jsonl"
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_DISK_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index: Dict[str, Dict] = self._load_index()
+        self._journal_entries = self._replay_journal()
+        # keys read since their last access time was written
+        self._accessed: Set[str] = set()
+        for record in self._index.values():
+            self.size += record["size"]
+
+    def get(self, key: str, now: float, allow_stale: bool = False) -> CacheEntry | None:
+        """Returns the entry for `key` if the index says it is still fresh."""
+        with self._lock:
+            record = self._index.get(key)
+            if record is None:
+                return None
+            response = Response(
+                record["version"],
+                record["status"],
+                record["explanation"],
+                record["headers"],
+                "",
+            )
+            entry = CacheEntry(
+                response, record["request_time"], record["response_time"], 0
+            )
+            if not allow_stale and not entry.is_fresh(now):
+                return None
+            try:
+                response.body = self._read_blob(record["blob"])
+            except (OSError, ValueError):
+                self._remove(key)
+                return None
+            entry.size = _sizeof(response)
+            record["last_access"] = now
+            self._accessed.add(key)
+            if len(self._accessed) >= MAX_PENDING_ACCESSES:
+                self._journal_accesses()
+            return entry
+
+    def put(self, key: str, entry: CacheEntry):
+        body = entry.response.body.encode("utf8")
+        if len(body) > self.max_bytes:
+            return
+        blob = hashlib.sha256(key.encode("utf8")).hexdigest()
+        with self._lock:
+            self._remove(key)
+            _write_atomic(os.path.join(self.directory, blob), body)
+            record = self._index[key] = {
+                "blob": blob,
+                "size": len(body),
+                "version": entry.response.version,
+                "status": entry.response.status,
+                "explanation": entry.response.explanation,
+                "headers": dict(entry.response.headers),
+                "request_time": entry.request_time,
+                "response_time": entry.response_time,
+                "last_access": entry.response_time,
+            }
+            self.size += len(body)
+            self._journal(key, record)
+            self._evict()
+
+    def update(self, key: str, entry: CacheEntry):
+        """Rewrites the metadata for `key` while keeping the stored body."""
+        with self._lock:
+            record = self._index.get(key)
+            if record is None:
+                return
+            record["headers"] = dict(entry.response.headers)
+            record["request_time"] = entry.request_time
+            record["response_time"] = entry.response_time
+            record["last_access"] = entry.response_time
+            self._journal(key, record)
+
+    def remove(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def flush(self):
+        """Folds the journal, and last access times, back into the index."""
+        with self._lock:
+            self._save_index()
+
+    def clear(self):
+        with self._lock:
+            for record in self._index.values():
+                try:
+                    os.remove(os.path.join(self.directory, record["blob"]))
+                except FileNotFoundError:
+                    pass
+            self._index.clear()
+            self.size = 0
+            self._save_index()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _evict(self):
+        if self.size <= self.max_bytes:
+            return
+        by_age = sorted(self._index, key=lambda k: self._index[k]["last_access"])
+        for key in by_age:
+            if self.size <= self.max_bytes:
+                break
+            self._remove(key)
+
+    def _remove(self, key: str):
+        record = self._index.pop(key, None)
+        if record is None:
+            return
+        self.size -= record["size"]
+        try:
+            os.remove(os.path.join(self.directory, record["blob"]))
+        except FileNotFoundError:
+            pass
+        self._journal(key, None)
+
+    def _read_blob(self, blob: str) -> str:
+        with open(os.path.join(self.directory, blob), "rb") as f:
+            return f.read().decode("utf8")
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(os.path.join(self.directory, self.INDEX)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _replay_journal(self) -> int:
+        entries = 0
+        try:
+            with open(os.path.join(self.directory, self.JOURNAL)) as f:
+                for line in f:
+                    try:
+                        key, record = json.loads(line)
+                    except ValueError:
+                        # the last line may be cut short by a crash
+                        break
+                    if record is None:
+                        self._index.pop(key, None)
+                    else:
+                        self._index[key] = record
+                    entries += 1
+        except OSError:
+            pass
+        return entries
+
+    def _journal_accesses(self):
+        accessed, self._accessed = self._accessed, set()
+        for key in accessed:
+            record = self._index.get(key)
+            if record is not None:
+                self._journal(key, record)
+
+    def _journal(self, key: str, record: Dict | None):
+        """Records a changed (or, if `record` is None, removed) index entry."""
+        if self._journal_entries >= MAX_JOURNAL_ENTRIES:
+            self._save_index()
+            return
+        with open(os.path.join(self.directory, self.JOURNAL), "a") as f:
+            f.write(json.dumps([key, record]) + "\n")
+        self._journal_entries += 1
+
+    def _save_index(self):
+        index = json.dumps(self._index).encode("utf8")
+        _write_atomic(os.path.join(self.directory, self.INDEX), index)
+        # everything journaled is in the index now
+        with open(os.path.join(self.directory, self.JOURNAL), "w"):
+            pass
+        self._journal_entries = 0
+        self._accessed.clear()
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class HttpCache:
+    """An in-memory HTTP cache with a byte budget and LRU eviction.
+
+    One cache is shared by every tab in a browser, so it behaves as a private
+    cache unless `shared` is set, in which case `private` responses are not
+    stored. If a `disk` cache is given, stored responses are written through
+    to it and memory misses fall back to it.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_CACHE_BYTES,
+        shared: bool = False,
+        disk: DiskCache | None = None,
+    ):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.disk = disk
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.revalidations = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, now: float | None = None) -> Response | None:
+        """Returns the cached response for `key` if it is still fresh."""
+        now = time.time() if now is None else now
+        with self._lock:
+            stale = self._entries.get(key)
+            if stale is not None and stale.is_fresh(now):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return stale.response
+
+        # the disk is read without holding the lock, so other threads can
+        # use the memory cache meanwhile
+        entry = self.disk.get(key, now) if self.disk is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store_loaded(key, entry, stale)
+        return entry.response
+
+    def get_stale(self, key: str, now: float | None = None) -> CacheEntry | None:
+        """Returns the entry for `key` if it can be revalidated."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key, now, allow_stale=True)
+            if entry is not None:
+                with self._lock:
+                    self._store_loaded(key, entry, None)
+        if entry is None or not entry.conditional_headers():
+            return None
+        return entry
+
+    def refresh(
+        self,
+        key: str,
+        stale: CacheEntry,
+        not_modified: Response,
+        request_time: float,
+        response_time: float | None = None,
+    ) -> Response:
+        """Freshens `stale` with the headers of a 304 and returns its response."""
+        response_time = time.time() if response_time is None else response_time
+        headers = dict(stale.response.headers)
+        for header, value in not_modified.headers.items():
+            if header not in NOT_MODIFIED_SKIP_HEADERS:
+                headers[header] = value
+        stale.response.headers = headers
+        stale.request_time = request_time
+        stale.response_time = response_time
+        storable = self._is_storable(stale)
+        with self._lock:
+            self.revalidations += 1
+            if not storable:
+                self._remove(key)
+        if self.disk is not None:
+            if storable:
+                self.disk.update(key, stale)
+            else:
+                self.disk.remove(key)
+        return stale.response
+
+    def put(
+        self,
+        key: str,
+        response: Response,
+        request_time: float,
+        response_time: float | None = None,
+    ):
+        response_time = time.time() if response_time is None else response_time
+        entry = CacheEntry(response, request_time, response_time, _sizeof(response))
+        storable = self._is_storable(entry)
+        with self._lock:
+            self._remove(key)
+            if storable:
+                self._store(key, entry)
+        if self.disk is not None:
+            if storable:
+                self.disk.put(key, entry)
+            else:
+                self.disk.remove(key)
+
+    def remove(self, key: str):
+        with self._lock:
+            self._remove(key)
+        if self.disk is not None:
+            self.disk.remove(key)
+
+    def flush(self):
+        """Writes anything the disk cache is holding back."""
+        if self.disk is not None:
+            self.disk.flush()
+
+    def is_storable(self, response: Response) -> bool:
+        """Whether `response` would be kept, judging by its headers alone."""
+        now = time.time()
+        return self._is_storable(CacheEntry(response, now, now, 0))
+
+    def clear(self):
+        """Empties the cache, including the disk cache if there is one."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                self.hits,
+                self.misses,
+                len(self._entries),
+                self.size,
+                self.disk_hits,
+                self.revalidations,
+            )
+
+    def _store(self, key: str, entry: CacheEntry):
+        self._remove(key)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def _store_loaded(self, key: str, entry: CacheEntry, replaces: CacheEntry | None):
+        # an entry put while the disk was being read is newer, so it stays
+        if self._entries.get(key) is replaces:
+            self._store(key, entry)
+
+    def _is_storable(self, entry: CacheEntry) -> bool:
+        if entry.response.status not in CACHEABLE_STATUSES:
+            return False
+        directives = entry.directives
+        if "no-store" in directives:
+            return False
+        if self.shared and "private" in directives:
+            return False
+        # entries without a lifetime are still worth keeping if they can be
+        # revalidated instead of downloaded again
+        if entry.conditional_headers():
+            return True
+        if "no-cache" in directives:
+            return False
+        return entry.freshness_lifetime() > 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+def _sizeof(response: Response) -> int:
+    size = sys.getsizeof(response.body)
+    for header, value in response.headers.items():
+        size += sys.getsizeof(header) + sys.getsizeof(value)
+    return size
+
+
+HTTP_CACHE = HttpCache()
+
 
 class URL(object):
     def __init__(self, url: str):
@@ -56,9 +842,6 @@ class URL(object):
             self.port = DEFAULT_PORTS.get(self.scheme, None)
 
         self.path = "/" + url
-        # XXX: move this stuff out
-        self.sockets = {}
-        self.cache = {}
 
     def __hash__(self):
         return hash((self.scheme, self.host, self.port, self.path, self.is_viewsource))
@@ -74,17 +857,17 @@ class URL(object):
             and self.is_viewsource == other.is_viewsource
         )
 
-    def num_sockets(self) -> int:
-        return len(self.sockets)
-
-    def request_response(self) -> Response:
+    def request_response(
+        self, cache: HttpCache | None = None, timeout: float | None = None
+    ) -> Response:
         # XXX: some error handling
         match self.scheme:
             case Scheme.FILE:
                 with open(self.path) as f:
                     response = Response(body="\n".join(f.readlines()))
             case Scheme.HTTP | Scheme.HTTPS:
-                response = _handle_http(self)
+                cache = HTTP_CACHE if cache is None else cache
+                response = _handle_http(self, cache, timeout)
             case Scheme.DATA:
                 response = Response(body=self.path.split(",", 1)[1])
             case _:
@@ -92,110 +875,166 @@ class URL(object):
 
         return response
 
-    def _fetch_http(self) -> IO[bytes]:
-        host_port = (self.host, self.port)
-        s = self.sockets.get(host_port, None)
-        if s is None or s.fileno() == -1:
-            s = self._init_socket(host_port)
+    def stream(
+        self, cache: HttpCache | None = None, timeout: float | None = None
+    ) -> Iterator[str]:
+        """Yields the body as decoded text chunks as it arrives.
+
+        Only chunk-sized pieces of the body are held at a time, unless the
+        response is going into `cache`.
+        """
+        if self.scheme not in (Scheme.HTTP, Scheme.HTTPS):
+            yield self.request_response(cache, timeout).body
+            return
+        cache = HTTP_CACHE if cache is None else cache
+        yield from _stream_http(self, cache, timeout)
+
+    def _fetch_http(
+        self,
+        headers: Mapping[str, str] | None = None,
+        timeout: float | None = None,
+    ) -> Response:
+        with self._open_http(headers, timeout) as (response, body):
+            response.body = "".join(body)
+        return response
+
+    @contextmanager
+    def _open_http(
+        self,
+        headers: Mapping[str, str] | None = None,
+        timeout: float | None = None,
+    ) -> Iterator[Tuple[Response, "BodyReader"]]:
+        """Sends a request, yielding the response headers and a body reader.
+
+        The socket goes back to the pool when the block exits, and is only
+        kept if the whole body was read.
+        """
+        key = (self.scheme, self.host, self.port)
+        request = self._build_request(headers).encode("utf8")
+        while True:
+            s, reused = POOL.acquire(key, timeout)
+            raw = None
+            try:
+                s.sendall(request)
+                raw = s.makefile("rb", newline="\r\n")
+                response = Response()
+                self._parse_statusline(raw, response)
+                self._parse_headers(raw, response)
+                break
+            except (OSError, ValueError):
+                if raw is not None:
+                    raw.close()
+                POOL.release(key, s, reuse=False)
+                # the server may have dropped a pooled socket while it was
+                # idle, so try again on a fresh one
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                if raw is not None:
+                    raw.close()
+                POOL.release(key, s, reuse=False)
+                raise
 
-        request = self._build_request()
+        body = BodyReader(raw, response)
         try:
-            s.send(request.encode("utf8"))
-        except BrokenPipeError:
-            s = self._init_socket(host_port)
-            s.send(request.encode("utf8"))
+            yield response, body
+        except BaseException:
+            raw.close()
+            POOL.release(key, s, reuse=False)
+            raise
+        raw.close()
+        POOL.release(key, s, reuse=body.done and _is_persistent(response))
 
-        raw_response = s.makefile("rb", newline="\r\n")
+    def request(
+        self, cache: HttpCache | None = None, timeout: float | None = None
+    ) -> str:
+        response = self.request_response(cache, timeout)
+        return response.body
 
-        return raw_response
+    async def request_response_async(
+        self, cache: HttpCache | None = None, timeout: float | None = None
+    ) -> Response:
+        if self.scheme not in (Scheme.HTTP, Scheme.HTTPS):
+            # nothing to wait on for local schemes
+            return self.request_response(cache, timeout)
+        cache = HTTP_CACHE if cache is None else cache
+        return await _handle_http_async(self, cache, timeout)
 
-    def _init_socket(self, host_port):
-        s = socket.socket(
-            family=socket.AF_INET, type=socket.SOCK_STREAM, proto=socket.IPPROTO_TCP
-        )
-        if self.scheme == Scheme.HTTPS:
-            ctx = ssl.create_default_context()
-            s = ctx.wrap_socket(s, server_hostname=self.host)
-        s.connect(host_port)
-        self.sockets[host_port] = s
-        return s
-
-    def request(self) -> str:
-        response = self.request_response()
+    async def request_async(
+        self, cache: HttpCache | None = None, timeout: float | None = None
+    ) -> str:
+        response = await self.request_response_async(cache, timeout)
         return response.body
 
-    def _build_request(self):
+    async def _fetch_http_async(
+        self,
+        headers: Mapping[str, str] | None = None,
+        timeout: float | None = None,
+    ) -> Response:
+        key = (self.scheme, self.host, self.port)
+        request = self._build_request(headers).encode("utf8")
+        pool = async_pool()
+        while True:
+            stream, reused = await asyncio.wait_for(pool.acquire(key), timeout)
+            reader, writer = stream
+            try:
+                writer.write(request)
+                await asyncio.wait_for(writer.drain(), timeout)
+                response = await asyncio.wait_for(
+                    self._parse_response_async(reader), timeout
+                )
+            except (OSError, ValueError, EOFError):
+                pool.release(key, stream, reuse=False)
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                pool.release(key, stream, reuse=False)
+                raise
+            pool.release(key, stream, reuse=_is_persistent(response))
+            return response
+
+    async def _parse_response_async(self, reader: asyncio.StreamReader) -> Response:
+        response = Response()
+        _apply_statusline((await reader.readline()).decode("utf8"), response)
+        headers: Dict[str, str] = {}
+        while _apply_header((await reader.readline()).decode("utf8"), headers):
+            pass
+        response.headers = headers
+
+        framing = BodyFraming(response)
+        decoder = BodyDecoder(_is_gzipped(response))
+        parts = []
+        while (size := framing.next_read()) is not None:
+            if size == READ_LINE:
+                data = await reader.readline()
+            else:
+                data = await reader.read(size)
+            parts.append(decoder.feed(framing.feed(data)))
+        parts.append(decoder.close())
+        response.body = "".join(parts)
+        return response
+
+    def _build_request(self, headers: Mapping[str, str] | None = None):
         request = f"GET {self.path} HTTP/1.1\r\n"
         request += f"Host: {self.host}\r\n"
         request += "User-Agent: Giraffe\r\n"
         request += "Accept-Encoding: gzip\r\n"
+        for header, value in (headers or {}).items():
+            request += f"{header}: {value}\r\n"
         request += "\r\n"
         return request
 
-    def _parse_response(self, raw: IO[bytes]) -> Response:
-        response = Response()
-        self._parse_statusline(raw, response)
-        self._parse_headers(raw, response)
-        self._parse_content(raw, response)
-        return response
-
     def _parse_statusline(self, raw: IO[bytes], response: Response):
-        statusline = raw.readline().decode("utf8")
-        version, status, explanation = statusline.split(" ", 2)
-        response.version = version
-        response.status = status
-        response.explanation = explanation
+        _apply_statusline(raw.readline().decode("utf8"), response)
 
     def _parse_headers(self, raw: IO[bytes], response: Response):
-        response_headers = {}
-
-        while True:
-            line = raw.readline().decode("utf8")
-            if line == "\r\n":
-                break
-            header, value = line.split(":", 1)
-            response_headers[header.casefold()] = value.strip()
-
-        if "content-encoding" in response_headers:
-            assert response_headers["content-encoding"] == "gzip"
-
+        response_headers: Dict[str, str] = {}
+        while _apply_header(raw.readline().decode("utf8"), response_headers):
+            pass
         response.headers = response_headers
 
-    def _parse_content(self, raw: IO[bytes], response: Response):
-        bbody = BytesIO()
-        if self._is_chunked(response):
-            while True:
-                chunk_size = int(raw.readline().strip(), 16)
-                if chunk_size == 0:
-                    raw.readline()
-                    break
-
-                chunk = raw.read(chunk_size)
-                # skip \r\n
-                raw.read(2)
-                bbody.write(chunk)
-        else:
-            content_len = int(response.headers["content-length"])
-            bbody.write(raw.read(content_len))
-
-        if self._is_gzipped(response):
-            body = gzip.decompress(bbody.getvalue())
-            response.body = body.decode("utf8")
-        else:
-            response.body = bbody.getvalue().decode("utf8")
-
-    def _is_chunked(self, response) -> bool:
-        return (
-            "transfer-encoding" in response.headers
-            and response.headers["transfer-encoding"] == "chunked"
-        )
-
-    def _is_gzipped(self, response) -> bool:
-        return (
-            "content-encoding" in response.headers
-            and response.headers["content-encoding"] == "gzip"
-        )
-
     def resolve(self, url: str) -> "URL":
         if "://" in url:
             return URL(url)
@@ -230,43 +1069,330 @@ class URL(object):
             return f"{self.scheme.name.lower()}://{self.host}{port_part}{self.path}"
 
 
+def _is_chunked(response: Response) -> bool:
+    return (
+        "transfer-encoding" in response.headers
+        and response.headers["transfer-encoding"] == "chunked"
+    )
+
+
+def _is_gzipped(response: Response) -> bool:
+    return (
+        "content-encoding" in response.headers
+        and response.headers["content-encoding"] == "gzip"
+    )
+
+
+class BodyDecoder:
+    """Incrementally gunzips and UTF-8 decodes a body fed to it in pieces."""
+
+    def __init__(self, gzipped: bool):
+        self.gzipped = gzipped
+        self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        self._text = codecs.getincrementaldecoder("utf8")()
+
+    def feed(self, data: bytes) -> str:
+        if self._inflate is not None:
+            data = self._inflate_all(data)
+        return self._text.decode(data)
+
+    def close(self) -> str:
+        data = b""
+        if self._inflate is not None:
+            data = self._inflate.flush()
+            if not self._inflate.eof:
+                raise EOFError("gzip stream ended early")
+        return self._text.decode(data, final=True)
+
+    def _inflate_all(self, data: bytes) -> bytes:
+        assert self._inflate is not None
+        out = self._inflate.decompress(data)
+        # a gzip body can be made of several members back to back
+        while self._inflate.eof and self._inflate.unused_data:
+            unused = self._inflate.unused_data
+            self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            out += self._inflate.decompress(unused)
+        return out
+
+
+READ_LINE = -1
+Framing = Enum("Framing", ["SIZE", "DATA", "CRLF", "TRAILER", "DONE"])
+
+
+class BodyFraming:
+    """Picks the body of a response out of the bytes that follow its headers.
+
+    It does no I/O itself: `next_read` says what to read next, either a line
+    (READ_LINE) or up to a number of bytes, or None once the body has ended,
+    and `feed` is given what was read and returns the body bytes in it.
+    """
+
+    def __init__(self, response: Response):
+        self.chunked = _is_chunked(response)
+        # bytes left of the body, the current chunk or the \r\n after it
+        self.remaining = 0
+        if response.status in BODYLESS_STATUSES:
+            self.state = Framing.DONE
+        elif self.chunked:
+            self.state = Framing.SIZE
+        else:
+            self.remaining = int(response.headers["content-length"])
+            self.state = Framing.DATA if self.remaining else Framing.DONE
+
+    def next_read(self) -> int | None:
+        if self.state == Framing.DONE:
+            return None
+        if self.state == Framing.DATA:
+            return min(self.remaining, MAX_CHUNK)
+        if self.state == Framing.CRLF:
+            return self.remaining
+        # the size line of a chunk, or the end of the last chunk
+        return READ_LINE
+
+    def feed(self, data: bytes) -> bytes:
+        if not data:
+            raise EOFError("connection closed before the body ended")
+        if self.state == Framing.SIZE:
+            self.remaining = int(data.strip(), 16)
+            self.state = Framing.DATA if self.remaining else Framing.TRAILER
+        elif self.state == Framing.DATA:
+            self.remaining -= len(data)
+            if not self.remaining and self.chunked:
+                self.remaining = 2
+                self.state = Framing.CRLF
+            elif not self.remaining:
+                self.state = Framing.DONE
+            return data
+        elif self.state == Framing.CRLF:
+            self.remaining -= len(data)
+            if not self.remaining:
+                self.state = Framing.SIZE
+        elif self.state == Framing.TRAILER:
+            self.state = Framing.DONE
+        return b""
+
+
+class BodyReader:
+    """Iterates over the decoded text of a response body as it is read."""
+
+    def __init__(self, raw: IO[bytes], response: Response):
+        self.raw = raw
+        self.response = response
+        # nothing to read for a bodyless response, so the socket can be reused
+        self.done = response.status in BODYLESS_STATUSES
+
+    def __iter__(self) -> Iterator[str]:
+        decoder = BodyDecoder(_is_gzipped(self.response))
+        for data in self._read_raw():
+            text = decoder.feed(data)
+            if text:
+                yield text
+        text = decoder.close()
+        self.done = True
+        if text:
+            yield text
+
+    def _read_raw(self) -> Iterator[bytes]:
+        framing = BodyFraming(self.response)
+        while (size := framing.next_read()) is not None:
+            if size == READ_LINE:
+                data = self.raw.readline()
+            else:
+                data = self.raw.read(size)
+            data = framing.feed(data)
+            if data:
+                yield data
+
+
+def _is_persistent(response: Response) -> bool:
+    connection = response.headers.get("connection", "").casefold()
+    if response.version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+def _apply_statusline(statusline: str, response: Response):
+    version, status, explanation = statusline.split(" ", 2)
+    response.version = version
+    response.status = status
+    response.explanation = explanation
+
+
+def _apply_header(line: str, headers: Dict[str, str]) -> bool:
+    """Adds a header line to `headers`, returning False at the end of them."""
+    if line == "\r\n":
+        return False
+    header, value = line.split(":", 1)
+    headers[header.casefold()] = value.strip()
+    if header.casefold() == "content-encoding":
+        assert headers["content-encoding"] == "gzip"
+    return True
+
+
+def _redirect_url(url: URL, response: Response) -> URL | None:
+    # XXX: assumes has a location header
+    if response.status != "301":
+        return None
+    location = response.headers["location"]
+    if not location.startswith("http"):
+        location = f"{url.scheme.name.lower()}://{url.host}:{url.port}{location}"
+    return URL(location)
+
+
+HttpRequest = Tuple[URL, Dict[str, str] | None]
+
+
 # XXX Move this into browser?
-def _handle_http(url: URL) -> Response:
+def _http_exchange(
+    url: URL, cache: HttpCache
+) -> Generator[HttpRequest, Response, Response]:
+    """The cache and redirect decisions behind fetching `url`, without the I/O.
+
+    Yields each (url, headers) request that has to be sent, and must be sent
+    the response to it. Returns the final response.
+    """
     response = Response()
-    needs_request = True
-    while needs_request:
-        cached = url.cache.get(url, None)
-        if cached:
-            max_age, response = cached
-            if time.time() < max_age:
-                return response
-
-        raw = url._fetch_http()
-        response = url._parse_response(raw)
-        # XXX: assumes has a location header
-        # TODO: handle max redirects
-        if response.status == "301":
-            location = response.headers["location"]
-            if not location.startswith("http"):
-                location = (
-                    f"{url.scheme.name.lower()}://{url.host}:{url.port}{location}"
-                )
-            url = URL(location)
+    for _ in range(MAX_REDIRECTS):
+        key = str(url)
+        cached = cache.get(key)
+        if cached is not None:
+            response = cached
         else:
-            needs_request = False
-
-        if (
-            "cache-control" in response.headers
-            and "no-store" not in response.headers["cache-control"]
-        ):
-            ccontrol = response.headers["cache-control"]
-            directives = ccontrol.split(",")
-            max_age = 0
-            for d in directives:
-                if "max-age" in d:
-                    _, max_age = d.split("=")
-                    max_age = int(max_age.strip())
-            if max_age:
-                url.cache[url] = (time.time() + max_age, response)
+            stale = cache.get_stale(key)
+            headers = stale.conditional_headers() if stale is not None else None
+            request_time = time.time()
+            response = yield url, headers
+            if stale is not None and response.status == "304":
+                response = cache.refresh(key, stale, response, request_time)
+            else:
+                cache.put(key, response, request_time)
+
+        next_url = _redirect_url(url, response)
+        if next_url is None:
+            break
+        url = next_url
 
     return response
+
+
+def _handle_http(url: URL, cache: HttpCache, timeout: float | None) -> Response:
+    exchange = _http_exchange(url, cache)
+    try:
+        url, headers = next(exchange)
+        while True:
+            url, headers = exchange.send(url._fetch_http(headers, timeout))
+    except StopIteration as done:
+        return done.value
+
+
+async def _handle_http_async(
+    url: URL, cache: HttpCache, timeout: float | None
+) -> Response:
+    exchange = _http_exchange(url, cache)
+    try:
+        url, headers = next(exchange)
+        while True:
+            response = await url._fetch_http_async(headers, timeout)
+            url, headers = exchange.send(response)
+    except StopIteration as done:
+        return done.value
+
+
+def fetch_all(
+    urls: List[URL],
+    cache: HttpCache | None = None,
+    timeout: float = RESOURCE_TIMEOUT_SECS,
+    budget: float = RESOURCE_BUDGET_SECS,
+) -> List[str | None]:
+    """Fetches the bodies of `urls` concurrently, in the same order as `urls`.
+
+    Each socket operation is limited to `timeout` seconds and the fetches as
+    a whole to `budget` seconds. The body of any fetch that failed or did not
+    finish in time is None.
+    """
+    if not urls:
+        return []
+
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(MAX_FETCH_WORKERS, len(urls))
+    )
+    futures = [executor.submit(url.request, cache, timeout) for url in urls]
+    done, _ = concurrent.futures.wait(futures, timeout=budget)
+    # don't wait on stragglers, they'll finish (or time out) in the background
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    bodies: List[str | None] = []
+    for future in futures:
+        if future in done and future.exception() is None:
+            bodies.append(future.result())
+        else:
+            bodies.append(None)
+    return bodies
+
+
+async def fetch_all_async(
+    urls: List[URL],
+    cache: HttpCache | None = None,
+    timeout: float = RESOURCE_TIMEOUT_SECS,
+    budget: float = RESOURCE_BUDGET_SECS,
+) -> List[str | None]:
+    """The asyncio counterpart to `fetch_all`, run on the current event loop."""
+    if not urls:
+        return []
+
+    tasks = [asyncio.ensure_future(url.request_async(cache, timeout)) for url in urls]
+    done, pending = await asyncio.wait(tasks, timeout=budget)
+    for task in pending:
+        task.cancel()
+
+    bodies: List[str | None] = []
+    for task in tasks:
+        if task in done and task.exception() is None:
+            bodies.append(task.result())
+        else:
+            bodies.append(None)
+    return bodies
+
+
+def _stream_http(url: URL, cache: HttpCache, timeout: float | None) -> Iterator[str]:
+    exchange = _http_exchange(url, cache)
+    streamed = False
+    try:
+        url, headers = next(exchange)
+        while True:
+            with url._open_http(headers, timeout) as (response, body):
+                if response.status == "301" or response.status in BODYLESS_STATUSES:
+                    response.body = "".join(body)
+                else:
+                    # the final response, so its body is passed on as it's read
+                    streamed = True
+                    text = yield from _tee_body(body, cache, response)
+                    if text is None:
+                        # don't let an older entry answer the next 304
+                        cache.remove(str(url))
+                        return
+                    response.body = text
+            url, headers = exchange.send(response)
+    except StopIteration as done:
+        if not streamed:
+            yield done.value.body
+
+
+def _tee_body(
+    body: BodyReader, cache: HttpCache, response: Response
+) -> Generator[str, None, str | None]:
+    """Yields the text of `body`, returning all of it if the cache will take it."""
+    parts: List[str] | None = None
+    if cache.is_storable(response):
+        parts = []
+    # a lower bound on _sizeof once the body is in, as str takes at least a
+    # byte per character
+    size = _sizeof(response)
+    for text in body:
+        if parts is not None:
+            parts.append(text)
+            size += len(text)
+            if size > cache.max_bytes:
+                parts = None
+        yield text
+    return "".join(parts) if parts is not None else None
@@ -1,5 +1,8 @@
-from dataclasses import dataclass, field
-from typing import Dict, List
+import html
+import re
+from enum import Enum
+from types import MappingProxyType
+from typing import Iterator, List, Mapping, Sequence, Tuple
 
 """The lexing and parsing code used by the browser.
 
@@ -56,29 +59,145 @@ INHERITED_PROPERTIES = {
 }
 
 
-def init_style():
-    return INHERITED_PROPERTIES.copy()
+StyleKey = Tuple[Tuple[str, str], ...]
+
+
+class ComputedStyle(Mapping[str, str]):
+    """An immutable, hashable set of computed properties.
+
+    Styles are interned by `giraffe.styling`, so equal styles are usually the
+    same object and can be compared, or used as a cache key, cheaply.
+    """
+
+    __slots__ = ("_properties", "_key", "_hash", "__weakref__")
+
+    def __init__(self, properties: Mapping[str, str], key: StyleKey | None = None):
+        self._properties = dict(properties)
+        self._key = style_key(self._properties) if key is None else key
+        self._hash = hash(self._key)
+
+    def __getitem__(self, property: str) -> str:
+        return self._properties[property]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._properties)
+
+    def __len__(self) -> int:
+        return len(self._properties)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ComputedStyle):
+            return self is other or self._key == other._key
+        return super().__eq__(other)
+
+    def __repr__(self) -> str:
+        return f"ComputedStyle({self._properties!r})"
+
+
+def style_key(properties: Mapping[str, str]) -> StyleKey:
+    return tuple(sorted(properties.items()))
+
+
+# Shared by every node until it is styled.
+DEFAULT_STYLE = ComputedStyle(INHERITED_PROPERTIES)
+EMPTY_ATTRIBUTES: Mapping[str, str] = MappingProxyType({})
+
+# Dirty bits, which tell `giraffe.styling.restyle` which parts of a tree to
+# visit. A new node has not been styled yet, so it starts out dirty.
+STYLE_DIRTY = 1
+CHILDREN_DIRTY = 2
 
 
-@dataclass(kw_only=True)
 class Node:
-    parent: "Element | None" = None
-    children: List["Text | Element"] = field(default_factory=list)
-    style: Dict[str, str] = field(default_factory=init_style)
+    """The base of the DOM.
+
+    Nodes are slotted and share their defaults, so a node's own memory is
+    little more than its fields. The style is only allocated once styling
+    computes one.
+    """
+
+    __slots__ = ("parent", "_style", "dirty")
+
+    children: Sequence["Text | Element"]
+
+    def __init__(self, parent: "Element | None" = None):
+        self.parent = parent
+        self._style: Mapping[str, str] | None = None
+        self.dirty = STYLE_DIRTY
+
+    @property
+    def style(self) -> Mapping[str, str]:
+        return DEFAULT_STYLE if self._style is None else self._style
+
+    @style.setter
+    def style(self, style: Mapping[str, str]):
+        self._style = style
+
+    def mark_style_dirty(self):
+        """Marks this node for restyling, and its ancestors as having to look."""
+        self.dirty |= STYLE_DIRTY
+        parent = self.parent
+        while parent is not None and not parent.dirty & CHILDREN_DIRTY:
+            parent.dirty |= CHILDREN_DIRTY
+            parent = parent.parent
 
 
-@dataclass
 class Text(Node):
-    text: str
+    __slots__ = ("text",)
+
+    # text never has children, so every Text shares the same empty tuple
+    children: Sequence["Text | Element"] = ()
+
+    def __init__(self, text: str, parent: "Element | None" = None):
+        super().__init__(parent)
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"Text({self.text!r})"
 
     def __str__(self) -> str:
         return self.text
 
 
-@dataclass
 class Element(Node):
-    tag: str
-    attributes: Dict[str, str] = field(default_factory=dict)
+    __slots__ = ("tag", "attributes", "children")
+
+    def __init__(
+        self,
+        tag: str,
+        attributes: Mapping[str, str] | None = None,
+        parent: "Element | None" = None,
+    ):
+        super().__init__(parent)
+        self.tag = tag
+        self.attributes = attributes if attributes else EMPTY_ATTRIBUTES
+        self.children: List["Text | Element"] = []
+
+    def set_attribute(self, name: str, value: str):
+        if self.attributes.get(name) == value:
+            return
+        if not isinstance(self.attributes, dict):
+            # don't write through to attributes shared with other elements
+            self.attributes = dict(self.attributes)
+        self.attributes[name] = value
+        self.mark_style_dirty()
+
+    def append_child(self, child: "Text | Element"):
+        child.parent = self
+        self.children.append(child)
+        # the whole subtree has new ancestors, so none of its styles hold
+        stack: List["Text | Element"] = [child]
+        while stack:
+            node = stack.pop()
+            node.dirty = STYLE_DIRTY | CHILDREN_DIRTY
+            stack.extend(node.children)
+        child.mark_style_dirty()
+
+    def __repr__(self) -> str:
+        return f"Element({self.tag!r}, {dict(self.attributes)!r})"
 
     def __str__(self) -> str:
         child_strs = ""
@@ -99,81 +218,187 @@ class Element(Node):
         return f"<{self.tag}{attrs}>{child_strs}{close_tag}"
 
 
+TAG_STOP = re.compile("[>\"']")
+SCRIPT_END = "</script>"
+SCRIPT_END_RE = re.compile(SCRIPT_END, re.IGNORECASE)
+COMMENT_START = "!--"
+COMMENT_END = "-->"
+ATTRIBUTE = re.compile(
+    r"""([^\s=]+)(?:\s*=\s*(?:"([^"]*)"?|'([^']*)'?|([^\s]*)))?"""
+)
+
+State = Enum("State", ["DATA", "TAG", "QUOTED", "SCRIPT", "COMMENT"])
+
+
 class HtmlParser:
-    def __init__(self, body: str, do_implicit=True):
+    """Builds a DOM either from a whole `body` or from pieces given to `feed`.
+
+    The tokenizer is a state machine where each state scans ahead in bulk to
+    the next character that can change state. All of its state lives on the
+    parser, so a chunk may end anywhere, in the middle of a tag, an
+    attribute, an entity or a script.
+    """
+
+    def __init__(self, body: str = "", do_implicit=True, is_viewsource=False):
         self.body = body
         self.unfinished: List[Element] = []
         self.do_implicit = do_implicit
+        self.is_viewsource = is_viewsource
+
+        self.state = State.DATA
+        # text carried over from the last chunk that needs more lookahead
+        self.pending = ""
+        # pieces of the text run or tag being tokenized
+        self.text: List[str] = []
+        self.tag: List[str] = []
+        self.quote = ""
+        self.comment_opened = False
+        self.states = {
+            State.DATA: self._data,
+            State.TAG: self._tag,
+            State.QUOTED: self._quoted,
+            State.SCRIPT: self._script,
+            State.COMMENT: self._comment,
+        }
 
     def parse(self, is_viewsource=False) -> Node:
-        if is_viewsource:
+        self.is_viewsource = self.is_viewsource or is_viewsource
+        self.feed(self.body)
+        return self.close()
+
+    def feed(self, chunk: str):
+        if self.is_viewsource:
+            self.text.append(chunk)
+            return
+        text = self.pending + chunk if self.pending else chunk
+        consumed = self._tokenize(text, final=False)
+        self.pending = text[consumed:]
+
+    def close(self) -> Node:
+        if self.is_viewsource:
             self.add_tag("view-source")
-            self.add_text(self.body)
+            self.add_text("".join(self.text))
             self.add_tag("/view-source")
+            self.text = []
             return self.finish()
 
-        buffer = ""
-        # XXX: probably state machine would help here
-        in_tag = False
-        in_script = False
-        in_attribute = False
-        in_double = False
-        in_single = False
-        consume = 0
-
-        for i, c in enumerate(self.body):
-            if consume:
-                consume -= 1
-                continue
-
-            if c == DOUBLE_QUOTE and in_tag and not in_double:
-                in_double = True
-                in_attribute = True
-                buffer += c
-            elif c == DOUBLE_QUOTE and in_double:
-                in_attribute = False
-                in_double = False
-                buffer += c
-            elif c == SINGLE_QUOTE and in_tag and not in_single:
-                in_attribute = True
-                in_single = True
-                buffer += c
-            elif c == SINGLE_QUOTE and in_single:
-                in_attribute = False
-                in_single = False
-                buffer += c
-            elif c == "<" and not in_script and not in_attribute:
-                in_tag = True
-                if buffer:
-                    self.add_text(buffer)
-                buffer = ""
-            elif c == "<" and in_script and self.body[i : i + 9] == "</script>":
-                in_tag = True
-                in_script = False
-                if buffer:
-                    self.add_text(buffer)
-                buffer = ""
-            elif c == ">" and not in_script and not in_attribute:
-                in_tag = False
-                if buffer == "script":
-                    in_script = True
-                self.add_tag(buffer)
-                buffer = ""
-            elif c == "&" and self.body[i : i + 4] == "&lt;":
-                buffer += "<"
-                consume += 3
-            elif c == "&" and self.body[i : i + 4] == "&gt;":
-                buffer += ">"
-                consume += 3
-            elif c == "&" and self.body[i : i + 5] == "&shy;":
-                buffer += SOFT_HYPHEN
-                consume += 4
-            else:
-                buffer += c
-        if not in_tag and buffer:
-            self.add_text(buffer)
+        self._tokenize(self.pending, final=True)
+        self.pending = ""
+        # an unclosed tag at the very end is dropped
+        if self.state in (State.DATA, State.SCRIPT):
+            self._flush_text()
+        self.text = []
+        self.tag = []
         return self.finish()
 
+    def _tokenize(self, text: str, final: bool) -> int:
+        """Consumes `text`, returning how much of it was used.
+
+        A state that can't make progress without seeing more input returns
+        the position it was given, and the rest is kept for the next chunk.
+        """
+        i = 0
+        end = len(text)
+        while i < end:
+            next_i = self.states[self.state](text, i, final)
+            if next_i == i:
+                break
+            i = next_i
+        return i
+
+    def _data(self, text: str, i: int, final: bool) -> int:
+        j = text.find("<", i)
+        if j == -1:
+            self.text.append(text[i:])
+            return len(text)
+        if j > i:
+            self.text.append(text[i:j])
+        self._flush_text()
+        self.state = State.TAG
+        return j + 1
+
+    def _tag(self, text: str, i: int, final: bool) -> int:
+        if not self.tag:
+            if text.startswith(COMMENT_START, i):
+                self.state = State.COMMENT
+                self.comment_opened = True
+                return i + len(COMMENT_START)
+            rest = text[i : i + len(COMMENT_START)]
+            if not final and len(rest) < 3 and COMMENT_START.startswith(rest):
+                return i
+
+        match = TAG_STOP.search(text, i)
+        if match is None:
+            self.tag.append(text[i:])
+            return len(text)
+        j = match.start()
+        self.tag.append(text[i : j + 1])
+        if text[j] != ">":
+            self.quote = text[j]
+            self.state = State.QUOTED
+            return j + 1
+
+        tag = "".join(self.tag)[:-1]
+        self.tag = []
+        self.add_tag(tag)
+        name = tag.split(None, 1)[0].casefold() if tag.strip() else ""
+        self.state = State.SCRIPT if name == "script" else State.DATA
+        return j + 1
+
+    def _quoted(self, text: str, i: int, final: bool) -> int:
+        j = text.find(self.quote, i)
+        if j == -1:
+            self.tag.append(text[i:])
+            return len(text)
+        self.tag.append(text[i : j + 1])
+        self.state = State.TAG
+        return j + 1
+
+    def _script(self, text: str, i: int, final: bool) -> int:
+        match = SCRIPT_END_RE.search(text, i)
+        if match is not None:
+            if match.start() > i:
+                self.text.append(text[i : match.start()])
+            self._flush_text()
+            self.add_tag("/script")
+            self.state = State.DATA
+            return match.end()
+
+        # hold back anything that could be the start of a cut off end tag
+        j = len(text)
+        if not final:
+            lt = text.rfind("<", max(i, len(text) - len(SCRIPT_END)))
+            if lt != -1 and SCRIPT_END.startswith(text[lt:].casefold()):
+                j = lt
+        if j > i:
+            self.text.append(text[i:j])
+        return j
+
+    def _comment(self, text: str, i: int, final: bool) -> int:
+        # `<!-->` and `<!--->` are complete, if empty, comments
+        if self.comment_opened:
+            if not final and i == len(text) - 1 and text[i] == "-":
+                return i
+            self.comment_opened = False
+            for abrupt in (">", "->"):
+                if text.startswith(abrupt, i):
+                    self.state = State.DATA
+                    return i + len(abrupt)
+
+        j = text.find(COMMENT_END, i)
+        if j != -1:
+            self.state = State.DATA
+            return j + len(COMMENT_END)
+        if final:
+            return len(text)
+        # keep enough to spot an end marker split across chunks
+        return max(i, len(text) - len(COMMENT_END) + 1)
+
+    def _flush_text(self):
+        if self.text:
+            self.add_text(unescape("".join(self.text)))
+            self.text = []
+
     def add_text(self, text: str):
         if text.isspace():
             return
@@ -222,55 +447,19 @@ class HtmlParser:
             parent = self.unfinished[-1] if self.unfinished else None
             node = Element(tag, attributes, parent=parent)
             self.unfinished.append(node)
-            if tag == "script":
-                self.in_script = True
 
     def get_attributes(self, text: str):
-        parts = text.split(" ")
+        parts = text.split(None, 1)
+        if not parts:
+            return "", {}
         tag = parts[0].casefold()
 
-        buffer = ""
-        key = ""
-        in_value = False
-        in_single = False
-        in_double = False
-
         attributes = {}
-
-        for c in text[len(tag) :]:
-            if c == " " and not in_value and buffer:
-                attributes[buffer.casefold()] = ""
-                buffer = ""
-            elif c in WS and not in_value and not in_single and not in_double:
-                continue
-            elif (c == " " or c in WS) and (in_single or in_double):
-                buffer += c
-            elif c == " " and in_value and not in_single and not in_double:
-                attributes[key.casefold()] = buffer
-                buffer = ""
-                key = ""
-                in_value = False
-            elif c == "=" and not in_value:
-                key = buffer
-                buffer = ""
-                in_value = True
-            elif c == SINGLE_QUOTE and in_value and not in_single:
-                in_single = True
-            elif c == SINGLE_QUOTE and in_value and in_single:
-                in_single = False
-            elif c == DOUBLE_QUOTE and in_value and not in_double:
-                in_double = True
-            elif c == DOUBLE_QUOTE and in_value and in_double:
-                in_double = False
-            elif c == " ":
-                continue
-            else:
-                buffer += c
-
-        if not in_value and buffer:
-            attributes[buffer.casefold()] = ""
-        elif in_value and buffer:
-            attributes[key.casefold()] = buffer
+        if len(parts) > 1:
+            for match in ATTRIBUTE.finditer(parts[1]):
+                key, double, single, bare = match.groups()
+                value = next((v for v in (double, single, bare) if v is not None), "")
+                attributes[key.casefold()] = unescape(value)
 
         return tag, attributes
 
@@ -285,6 +474,9 @@ class HtmlParser:
 
     def implicit_tags(self, tag):
         while True and self.do_implicit:
+            # implicit tags only ever go in the first couple of levels
+            if len(self.unfinished) > 2:
+                break
             open_tags = [node.tag for node in self.unfinished]
             if open_tags == [] and tag != "html":
                 self.add_tag("html")
@@ -299,6 +491,18 @@ class HtmlParser:
                 break
 
 
+def unescape(text: str) -> str:
+    """Decodes named and numeric character references.
+
+    `html.unescape` finds every reference with one precompiled regex and
+    looks it up in the full HTML5 entity table, taking the longest known
+    prefix for legacy names written without a semicolon.
+    """
+    if "&" not in text:
+        return text
+    return html.unescape(text)
+
+
 def print_tree(node: Node, indent=0):
     print(" " * indent, str(node))
     for child in node.children:
@@ -1,7 +1,32 @@
+import functools
+import hashlib
+import heapq
+import os
+import re
+import threading
+import weakref
+from collections import Counter, OrderedDict
 from dataclasses import dataclass
-from typing import List
-
-from giraffe.parser import INHERITED_PROPERTIES, Element, Node
+from types import MappingProxyType
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Mapping,
+    Sequence,
+    Tuple,
+)
+
+from giraffe.parser import (
+    CHILDREN_DIRTY,
+    INHERITED_PROPERTIES,
+    STYLE_DIRTY,
+    ComputedStyle,
+    Element,
+    Node,
+    style_key,
+)
 
 """A parser for CSS used in web pages.
 
@@ -31,6 +56,23 @@ class Rule:
         return self.selector.priority
 
 
+# A word is a run of alphanumerics (as str.isalnum() defines them) or "#-.%".
+_WORD = r"(?:[^\W_]|[-#.%])+"
+WORD = re.compile(_WORD)
+WHITESPACE = re.compile(r"\s*")
+# Fast paths for the common case: a whole selector, or a whole well-formed
+# declaration, in one match. Anything else goes through the slow path, which
+# knows how to report and recover from errors.
+SELECTOR = re.compile(rf"{_WORD}(?:\s+{_WORD})*\s*")
+RULE_START = re.compile(rf"\s*({_WORD}(?:\s+{_WORD})*)\s*{{\s*")
+DECLARATION = re.compile(rf"({_WORD})\s*:\s*({_WORD})\s*;\s*")
+
+
+@functools.lru_cache(maxsize=None)
+def _any_of(chars: str) -> "re.Pattern[str]":
+    return re.compile("[" + re.escape(chars) + "]")
+
+
 class CSSParser:
     def __init__(self, s: str, strict=False):
         self.s = s
@@ -41,10 +83,15 @@ class CSSParser:
         rules = []
         while self.i < len(self.s):
             try:
-                self.whitespace()
-                selector = self.selector()
-                self.literal("{")
-                self.whitespace()
+                m = RULE_START.match(self.s, self.i)
+                if m is not None:
+                    self.i = m.end()
+                    selector = selector_from_tags(m.group(1).split())
+                else:
+                    self.whitespace()
+                    selector = self.selector()
+                    self.literal("{")
+                    self.whitespace()
                 body = self.body()
                 self.whitespace()
                 self.literal("}")
@@ -61,6 +108,11 @@ class CSSParser:
         return rules
 
     def selector(self):
+        m = SELECTOR.match(self.s, self.i)
+        if m is not None and (m.end() == len(self.s) or self.s[m.end()] == "{"):
+            self.i = m.end()
+            return selector_from_tags(m.group().split())
+
         out = TagSelector(self.word().casefold())
         self.whitespace()
         while self.i < len(self.s) and self.s[self.i] != "{":
@@ -73,6 +125,11 @@ class CSSParser:
     def body(self) -> dict[str, str]:
         pairs = {}
         while self.i < len(self.s) and self.s[self.i] != "}":
+            m = DECLARATION.match(self.s, self.i)
+            if m is not None:
+                pairs[m.group(1).casefold()] = m.group(2)
+                self.i = m.end()
+                continue
             try:
                 prop, val = self.pair()
                 pairs[prop.casefold()] = val
@@ -100,23 +157,19 @@ class CSSParser:
         return prop.casefold(), val
 
     def word(self):
-        start = self.i
-        while self.i < len(self.s):
-            if self.s[self.i].isalnum() or self.s[self.i] in "#-.%":
-                self.i += 1
-            else:
-                break
-        if not (self.i > start):
+        m = WORD.match(self.s, self.i)
+        if m is None:
             raise ParseError("Parsing error", self.i)
-        return self.s[start : self.i]
+        self.i = m.end()
+        return m.group()
 
     def ignore_until(self, chars):
-        while self.i < len(self.s):
-            if self.s[self.i] in chars:
-                return self.s[self.i]
-            else:
-                self.i += 1
-        return None
+        m = _any_of("".join(chars)).search(self.s, self.i)
+        if m is None:
+            self.i = len(self.s)
+            return None
+        self.i = m.start()
+        return m.group()
 
     def literal(self, literal):
         if not (self.i < len(self.s) and self.s[self.i] == literal):
@@ -124,8 +177,7 @@ class CSSParser:
         self.i += 1
 
     def whitespace(self):
-        while self.i < len(self.s) and self.s[self.i].isspace():
-            self.i += 1
+        self.i = WHITESPACE.match(self.s, self.i).end()
 
 
 class TagSelector:
@@ -133,7 +185,7 @@ class TagSelector:
         self.tag = tag
         self.priority = 1
 
-    def matches(self, node: Node):
+    def matches(self, node: Node, ancestors: "Mapping[str, int] | None" = None):
         return isinstance(node, Element) and self.tag == node.tag
 
     def __repr__(self) -> str:
@@ -155,10 +207,21 @@ class DescendantSelector:
         self.ancestor = ancestor
         self.descendant = descendant
         self.priority = ancestor.priority + descendant.priority
+        self.ancestor_tags: FrozenSet[str] = frozenset(selector_tags(ancestor))
 
-    def matches(self, node):
+    def matches(self, node, ancestors: "Mapping[str, int] | None" = None):
+        """Tests whether node matches.
+
+        `ancestors` counts the tags of the elements above node. When given,
+        a node missing any tag this selector needs above it is rejected
+        without walking up the tree.
+        """
         if not self.descendant.matches(node):
             return False
+        if ancestors is not None:
+            for tag in self.ancestor_tags:
+                if not ancestors.get(tag):
+                    return False
         while node.parent:
             if self.ancestor.matches(node.parent):
                 return True
@@ -166,45 +229,357 @@ class DescendantSelector:
         return False
 
 
-DEFAULT_STYLE_SHEET = CSSParser(open("browser.css").read()).parse()
+def selector_from_tags(tags: List[str]) -> "TagSelector | DescendantSelector":
+    out: "TagSelector | DescendantSelector" = TagSelector(tags[0].casefold())
+    for tag in tags[1:]:
+        out = DescendantSelector(out, TagSelector(tag.casefold()))
+    return out
+
+
+@dataclass
+class HitStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+@dataclass
+class TableStats(HitStats):
+    size: int = 0
+
+
+def sort_rules(rules: Iterable[Rule]) -> List[Rule]:
+    return sorted(rules, key=lambda r: r.cascade_priority())
+
+
+def merge_rules(*sheets: Iterable[Rule]) -> List[Rule]:
+    """Merges sheets that are each sorted into one cascade-ordered list.
+
+    Rules with equal priority keep the order of the sheets they came from, as
+    sorting the concatenated sheets would.
+    """
+    return list(heapq.merge(*sheets, key=lambda r: r.cascade_priority()))
+
+
+DEFAULT_STYLE_SHEET_PATH = os.path.join(os.path.dirname(__file__), "browser.css")
+DEFAULT_STYLESHEET_ENTRIES = 32
+INLINE_STYLE_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=None)
+def default_style_sheet() -> Tuple[Rule, ...]:
+    """The browser's own rules, parsed on first use.
+
+    They are kept in cascade order so they can be merged with other sheets
+    as-is.
+    """
+    with open(DEFAULT_STYLE_SHEET_PATH, encoding="utf8") as f:
+        css = f.read()
+    return tuple(sort_rules(CSSParser(css).parse()))
+
+
+@functools.lru_cache(maxsize=None)
+def default_rule_index() -> "RuleIndex":
+    return RuleIndex(default_style_sheet(), is_sorted=True)
+
+
+class StylesheetCache:
+    """Parsed, sorted stylesheets keyed by URL and content hash, with LRU eviction.
+
+    Pages on one site usually link the same stylesheet, so it only needs to be
+    parsed once per process. The rules returned are shared and must not be
+    modified.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_STYLESHEET_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._sheets: OrderedDict[Tuple[str, bytes], Tuple[Rule, ...]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse(self, url: str, body: str) -> Tuple[Rule, ...]:
+        key = (url, hashlib.sha256(body.encode("utf8")).digest())
+        with self._lock:
+            rules = self._sheets.get(key)
+            if rules is not None:
+                self._sheets.move_to_end(key)
+                self.hits += 1
+                return rules
+            self.misses += 1
+
+        rules = tuple(sort_rules(CSSParser(body).parse()))
+        with self._lock:
+            self._sheets[key] = rules
+            self._sheets.move_to_end(key)
+            while len(self._sheets) > self.max_entries:
+                self._sheets.popitem(last=False)
+        return rules
+
+    def clear(self):
+        with self._lock:
+            self._sheets.clear()
+
+    def stats(self) -> TableStats:
+        with self._lock:
+            return TableStats(self.hits, self.misses, len(self._sheets))
+
+
+STYLESHEET_CACHE = StylesheetCache()
 
 
-def style(node: Node, rules: "None | List[Rule]" = None):
+def selector_tags(selector: "TagSelector | DescendantSelector") -> List[str]:
+    if isinstance(selector, DescendantSelector):
+        return selector_tags(selector.ancestor) + selector_tags(selector.descendant)
+    return [selector.tag]
+
+
+def rightmost_tag(selector: "TagSelector | DescendantSelector") -> "str | None":
+    if isinstance(selector, TagSelector):
+        return selector.tag
+    if isinstance(selector, DescendantSelector):
+        return selector.descendant.tag
+    return None
+
+
+class RuleIndex:
+    """Rules bucketed by the tag of their rightmost selector.
+
+    Each bucket is kept in cascade order and already includes the universal
+    rules (ones without a rightmost tag), so a node only looks at the rules
+    that could possibly match it.
+    """
+
+    def __init__(self, rules: Iterable[Rule] = (), is_sorted: bool = False):
+        self.rules = list(rules) if is_sorted else sort_rules(rules)
+        self._universal: List[Rule] = []
+        self._by_tag: Dict[str, List[Rule]] = {}
+        for rule in self.rules:
+            tag = rightmost_tag(rule.selector)
+            if tag is not None:
+                self._by_tag.setdefault(tag, [])
+        for rule in self.rules:
+            tag = rightmost_tag(rule.selector)
+            if tag is None:
+                self._universal.append(rule)
+                for bucket in self._by_tag.values():
+                    bucket.append(rule)
+            else:
+                self._by_tag[tag].append(rule)
+
+    def candidates(self, node: Node) -> Sequence[Rule]:
+        if isinstance(node, Element):
+            return self._by_tag.get(node.tag, self._universal)
+        return self._universal
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+
+class StyleTable:
+    """Hash-conses computed styles so that equal styles share one object.
+
+    Styles are held weakly, so a style disappears from the table once no
+    node uses it anymore.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._styles: "weakref.WeakValueDictionary[tuple, ComputedStyle]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    def intern(self, properties: Dict[str, str]) -> ComputedStyle:
+        key = style_key(properties)
+        computed = self._styles.get(key)
+        if computed is not None:
+            self.hits += 1
+            return computed
+        self.misses += 1
+        computed = ComputedStyle(properties, key)
+        self._styles[key] = computed
+        return computed
+
+    def stats(self) -> TableStats:
+        return TableStats(self.hits, self.misses, len(self._styles))
+
+
+STYLE_TABLE = StyleTable()
+
+
+def style(
+    node: Node,
+    rules: "None | List[Rule] | RuleIndex" = None,
+    ancestors: "Counter[str] | None" = None,
+):
+    if rules is None:
+        rules = default_rule_index()
+    if ancestors is None:
+        ancestors = ancestor_tags(node)
+    node.style = compute_style(node, rules, ancestors)
+    node.dirty = 0
+    _style_children(node, rules, ancestors)
+
+
+def restyle(
+    node: Node,
+    rules: "None | List[Rule] | RuleIndex" = None,
+    ancestors: "Counter[str] | None" = None,
+):
+    """Recomputes styles only where the tree under node is marked dirty.
+
+    When a node's style comes out different, its children are restyled too,
+    since they inherit from it. Otherwise only the dirty nodes below it are
+    visited.
+    """
     if rules is None:
-        rules = DEFAULT_STYLE_SHEET.copy()
+        rules = default_rule_index()
+    if ancestors is None:
+        ancestors = ancestor_tags(node)
+    _restyle(node, rules, ancestors, False)
+
+
+def _restyle(
+    node: Node,
+    rules: "List[Rule] | RuleIndex",
+    ancestors: "Counter[str]",
+    force: bool,
+):
+    changed = False
+    if force or node.dirty & STYLE_DIRTY:
+        old = node.style
+        node.style = compute_style(node, rules, ancestors)
+        changed = node.style is not old
+    visit = changed or node.dirty & CHILDREN_DIRTY
+    node.dirty = 0
+    if not visit or not node.children:
+        return
+
+    tag = node.tag if isinstance(node, Element) else None
+    if tag is not None:
+        ancestors[tag] += 1
+    for child in node.children:
+        _restyle(child, rules, ancestors, changed)
+    if tag is not None:
+        ancestors[tag] -= 1
+
+
+def invalidate_style(node: Node, rules: Iterable[Rule]):
+    """Marks the elements under node that `rules` could match for restyling."""
+    tags = set()
+    universal = False
+    for rule in rules:
+        tag = rightmost_tag(rule.selector)
+        if tag is None:
+            universal = True
+        else:
+            tags.add(tag)
+
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Element) and (universal or node.tag in tags):
+            node.mark_style_dirty()
+        stack.extend(node.children)
 
+
+def compute_style(
+    node: Node, rules: "List[Rule] | RuleIndex", ancestors: "Counter[str]"
+) -> ComputedStyle:
+    computed = {}
     for property, default_value in INHERITED_PROPERTIES.items():
         if node.parent:
-            node.style[property] = node.parent.style[property]
+            computed[property] = node.parent.style[property]
         else:
-            node.style[property] = default_value
+            computed[property] = default_value
 
-    for rule in rules:
-        if not rule.selector.matches(node):
+    candidates = rules.candidates(node) if isinstance(rules, RuleIndex) else rules
+    for rule in candidates:
+        if not rule.selector.matches(node, ancestors):
             continue
         for property, value in rule.body.items():
-            node.style[property] = value
+            computed[property] = value
 
     if isinstance(node, Element) and "style" in node.attributes:
-        pairs = CSSParser(node.attributes["style"]).body()
+        pairs = parse_inline_style(node.attributes["style"])
         for property, value in pairs.items():
-            node.style[property] = value
+            computed[property] = value
 
-    if node.style["font-size"].endswith("%"):
+    if computed["font-size"].endswith("%"):
         if node.parent:
             parent_font_size = node.parent.style["font-size"]
         else:
             parent_font_size = INHERITED_PROPERTIES["font-size"]
-        node_pct = float(node.style["font-size"][:-1]) / 100
+        node_pct = float(computed["font-size"][:-1]) / 100
         parent_px = float(parent_font_size[:-2])
-        node.style["font-size"] = str(node_pct * parent_px) + "px"
+        computed["font-size"] = str(node_pct * parent_px) + "px"
+    return STYLE_TABLE.intern(computed)
 
-    if isinstance(node, Element):
-        name = node.tag
-    else:
-        name = node.text
-    # print(f"{str(name)} -> {node.style}")
-    # print("")
 
+@functools.lru_cache(maxsize=INLINE_STYLE_CACHE_SIZE)
+def parse_inline_style(declarations: str) -> Mapping[str, str]:
+    """Parses a style attribute, once per distinct string.
+
+    Generated pages repeat the same few inline styles many times, so the
+    result is cached and shared, and is therefore read-only.
+    """
+    return MappingProxyType(CSSParser(declarations).body())
+
+
+def _style_children(
+    node: Node, rules: "List[Rule] | RuleIndex", ancestors: "Counter[str]"
+):
+    if not node.children:
+        return
+    tag = node.tag if isinstance(node, Element) else None
+    if tag is not None:
+        ancestors[tag] += 1
+
+    # Siblings see the same parent style and ancestors, so children with the
+    # same tag and inline style always compute the same style.
+    siblings: Dict[SharingKey, ComputedStyle] = {}
     for child in node.children:
-        style(child, rules)
+        key = sharing_key(child)
+        computed = siblings.get(key)
+        if computed is None:
+            STYLE_SHARING.misses += 1
+            computed = siblings[key] = compute_style(child, rules, ancestors)
+        else:
+            STYLE_SHARING.hits += 1
+        child.style = computed
+        child.dirty = 0
+        _style_children(child, rules, ancestors)
+
+    if tag is not None:
+        ancestors[tag] -= 1
+
+
+SharingKey = Tuple["str | None", "str | None"]
+
+
+def sharing_key(node: Node) -> SharingKey:
+    if isinstance(node, Element):
+        return (node.tag, node.attributes.get("style"))
+    return (None, None)
+
+
+STYLE_SHARING = HitStats()
+
+
+def sharing_stats() -> HitStats:
+    return HitStats(STYLE_SHARING.hits, STYLE_SHARING.misses)
+
+
+def ancestor_tags(node: Node) -> "Counter[str]":
+    ancestors: "Counter[str]" = Counter()
+    parent = node.parent
+    while parent is not None:
+        if isinstance(parent, Element):
+            ancestors[parent.tag] += 1
+        parent = parent.parent
+    return ancestors
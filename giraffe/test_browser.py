@@ -6,7 +6,7 @@ from http.server import SimpleHTTPRequestHandler
 import pytest
 
 from giraffe.browser import TAG_SCROLLBAR, Browser, Tab
-from giraffe.layout import TAG_TEXT
+from giraffe.layout import HEADLESS_FONTS, TAG_TEXT, DrawText
 from giraffe.net import URL
 
 """Test cases for the browser's net code.
@@ -73,6 +73,31 @@ def test_multi_tabs():
     assert len(browser.tabs) == 2
 
 
+def test_tab_headless():
+    tab = Tab(TEST_WIDTH, TEST_HEIGHT, TEST_CHROME_HEIGHT, fonts=HEADLESS_FONTS)
+    tab.load("data:text/html,<p>hi</p><p>there</p>")
+    texts = [cmd for cmd in tab.display_list if isinstance(cmd, DrawText)]
+    assert [text.text for text in texts] == ["hi", "there"]
+    assert texts[0].top < texts[1].top
+
+
+def test_tab_configure_headless():
+    tab = Tab(TEST_WIDTH * 4, TEST_HEIGHT, TEST_CHROME_HEIGHT, fonts=HEADLESS_FONTS)
+    tab.load("data:text/html,<p>" + "hello there " * 20 + "</p>")
+    document = tab.document
+    tab.configure(tab.width, TEST_HEIGHT * 2)
+    assert tab.document is document
+    assert tab.height == TEST_HEIGHT * 2
+
+    tab.configure(TEST_WIDTH * 2, TEST_HEIGHT)
+    fresh = Tab(TEST_WIDTH * 2, TEST_HEIGHT, TEST_CHROME_HEIGHT, fonts=HEADLESS_FONTS)
+    fresh.load(tab.location)
+    assert tab.document is document
+    assert [(c.left, c.top, c.text) for c in tab.display_list] == [
+        (c.left, c.top, c.text) for c in fresh.display_list
+    ]
+
+
 def test_tab_draw_no_scroll(tk_window):
     canvas = tkinter.Canvas(tk_window, width=TEST_WIDTH, height=TEST_HEIGHT)
     tab = Tab(TEST_WIDTH, TEST_HEIGHT, TEST_CHROME_HEIGHT)
@@ -1,10 +1,29 @@
+import concurrent.futures
+import gc
+import itertools
+import random
+import sys
 import tkinter
+import weakref
 from typing import List
 
 import pytest
 
-from giraffe.layout import DocumentLayout, TextLayout
+from giraffe.layout import (
+    CALIBRATION_TEXT,
+    HEADLESS_FONTS,
+    TK_FONTS,
+    DocumentLayout,
+    Font,
+    FontBackend,
+    GlyphMeasurer,
+    HeadlessFont,
+    HeadlessFontBackend,
+    MeasureCache,
+    TextLayout,
+)
 from giraffe.parser import Element, Node, Text
+from giraffe.styling import style
 
 """Test cases for the browser's layout engine.
 
@@ -47,9 +66,33 @@ def _setup_tkinter():
     pass
 
 
-def test_layout(_setup_tkinter):
+class SubpixelHeadlessFont(HeadlessFont):
+    """Headless, but with fractional advances rounded once per string."""
+
+    __slots__ = ()
+
+    def measure(self, text: str) -> int:
+        return round(len(text) * self["size"] * 0.61)
+
+
+class SubpixelFontBackend(HeadlessFontBackend):
+    def _make_font(self, family: str, size: int, weight: str, slant: str):
+        return SubpixelHeadlessFont(family, size, weight, slant)
+
+
+@pytest.fixture(params=["tk", "headless", "subpixel"])
+def fonts(request):
+    if request.param == "tk":
+        request.getfixturevalue("_setup_tkinter")
+        return TK_FONTS
+    if request.param == "subpixel":
+        return SubpixelFontBackend()
+    return HEADLESS_FONTS
+
+
+def test_layout(fonts):
     nodes = Text("hi mom")
-    root = DocumentLayout(nodes, WIDTH)
+    root = DocumentLayout(nodes, WIDTH, fonts=fonts)
     root.layout()
     first_text = get_text_layout(root, 0, 0)
     second_text = get_text_layout(root, 0, 1)
@@ -60,23 +103,26 @@ def test_layout(_setup_tkinter):
     assert first_text.x < second_text.x
 
 
-def test_layout_wraps(_setup_tkinter):
+def test_layout_wraps(fonts):
     nodes = Text(LOREM_IPSUM)
-    root = DocumentLayout(nodes, WIDTH)
+    root = DocumentLayout(nodes, WIDTH, fonts=fonts)
     root.layout()
     first_child = get_text_layout(root, 0, 0)
     last_child = get_text_layout(root, -1, -1)
     assert first_child.word == "Lorem"
     assert last_child.word == "laborum."
     assert first_child.y < last_child.y
+    for line in root.children[0].children:
+        last = line.children[-1]
+        assert last.x + last.width <= root.x + root.width
 
 
-def test_sup(_setup_tkinter):
+def test_sup(fonts):
     width = 100
     sup_tag = Element("sup")
     nodes = treeify(Element("div"), [Text("hey"), sup_tag])
     treeify(sup_tag, Text("guy"))
-    root = DocumentLayout(nodes, width)
+    root = DocumentLayout(nodes, width, fonts=fonts)
     root.layout()
     first = get_text_layout(root, 0, 0)
     second = get_text_layout(root, 0, 1)
@@ -86,6 +132,226 @@ def test_sup(_setup_tkinter):
     assert first.font["size"] != second.font["size"]
 
 
+def test_headless_font_is_deterministic():
+    font = HEADLESS_FONTS.get_font("Arial", 18, False, False)
+    assert font is HEADLESS_FONTS.get_font("Arial", 18, False, False)
+    assert font.measure("hi mom") == font.measure("hi") + font.measure(" mom")
+    assert font.measure("mmm") > font.measure("iii")
+    assert font.linespace == font.ascent + font.descent
+    assert font.metrics("ascent") == font.ascent
+    mono = HEADLESS_FONTS.get_font("Courier New", 18, False, False)
+    assert mono.measure("mmm") == mono.measure("iii")
+
+
+def test_font_backends_must_make_fonts():
+    class NoFonts(FontBackend):
+        pass
+
+    class NoMeasure(Font):
+        pass
+
+    with pytest.raises(TypeError):
+        NoFonts()
+    with pytest.raises(TypeError):
+        NoMeasure("none", {}, {"ascent": 1, "descent": 1, "linespace": 2})
+
+
+def test_style_fonts_do_not_keep_styles_alive():
+    fonts = HeadlessFontBackend()
+    node = treeify(Element("p", {"style": "font-size: 31px"}), Text("hi mom"))
+    style(node)
+    computed = weakref.ref(node.style)
+    DocumentLayout(node, WIDTH, fonts=fonts).layout()
+    assert fonts.style_fonts
+
+    del node
+    gc.collect()
+    assert computed() is None
+
+
+def test_style_fonts_shared_by_style():
+    fonts = HeadlessFontBackend()
+    first, second = Text("hi"), Text("mom")
+    treeify(Element("div"), [first, second])
+    style(first.parent)
+    assert first.style is second.style
+    font = fonts.style_font(first, "text", lambda: fonts.get_font("a", 9, False, False))
+    assert fonts.style_font(second, "text", lambda: None) is font
+    assert fonts.style_font(second, "block", lambda: None) is None
+
+
+def test_glyph_measurer_breaks_like_exact(fonts):
+    assert break_lines(GlyphMeasurer(), fonts) == break_lines(MeasureCache(), fonts)
+
+
+def _positions(root: DocumentLayout):
+    return [
+        [(text.word, text.x, text.y) for text in line.children]
+        for line in root.children[0].children
+    ]
+
+
+@pytest.mark.parametrize("measurer", [MeasureCache, GlyphMeasurer])
+def test_resize_matches_fresh_layout(measurer):
+    node = Text(LOREM_IPSUM * 3)
+    style(node)
+    root = DocumentLayout(node, WIDTH, measurer=measurer(), fonts=HEADLESS_FONTS)
+    root.layout()
+    for width in (600, 597, 1000, 120, WIDTH):
+        root.resize(width)
+        fresh = DocumentLayout(node, width, measurer=measurer(), fonts=HEADLESS_FONTS)
+        fresh.layout()
+        assert _positions(root) == _positions(fresh)
+        assert root.height == fresh.height
+
+
+def test_resize_keeps_lines_that_still_break_the_same():
+    div = Element("div")
+    short, long = Element("p"), Element("p")
+    treeify(div, [short, long])
+    treeify(short, Text("hi mom"))
+    treeify(long, Text(LOREM_IPSUM))
+    style(div)
+    root = DocumentLayout(div, WIDTH, fonts=HEADLESS_FONTS)
+    root.layout()
+    short_block, long_block = root.children[0].children
+    short_lines, long_lines = short_block.children, long_block.children
+
+    root.resize(WIDTH - 200)
+    assert short_block.children == short_lines
+    assert long_block.children != long_lines
+    assert len(long_block.children) > len(long_lines)
+
+
+class CountingFont:
+    """Stands in for a Tk font, counting how often it gets asked."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+
+    def measure(self, text: str) -> int:
+        self.calls += 1
+        return 10 * len(text)
+
+
+def test_measure_cache():
+    cache = MeasureCache()
+    font = CountingFont("font1")
+    assert cache.measure(font, "hello") == 50
+    assert cache.measure(font, "hello") == 50
+    assert cache.space_width(font) == 10
+    assert cache.space_width(font) == 10
+    assert font.calls == 2
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 1, 1)
+
+
+def test_measure_cache_keys_on_font():
+    cache = MeasureCache()
+    first, second = CountingFont("font1"), CountingFont("font2")
+    cache.measure(first, "hi")
+    cache.measure(second, "hi")
+    assert first.calls == second.calls == 1
+
+
+def test_measure_cache_is_thread_safe():
+    cache = MeasureCache(max_entries=50)
+    font = HEADLESS_FONTS.get_font("Arial", 18, False, False)
+
+    def measure_all(seed: int):
+        # a few more words than fit, so hits and evictions interleave
+        words = random.Random(seed)
+        for _ in range(20_000):
+            word = str(words.randrange(60))
+            assert cache.measure(font, word) == font.measure(word)
+
+    # switch threads as often as possible, so that a race is likely
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            for future in [executor.submit(measure_all, i) for i in range(4)]:
+                future.result()
+    finally:
+        sys.setswitchinterval(interval)
+    assert cache.stats().size <= 50
+
+
+def test_measure_cache_evicts_least_recently_used():
+    cache = MeasureCache(max_entries=2)
+    font = CountingFont("font1")
+    cache.measure(font, "a")
+    cache.measure(font, "b")
+    cache.measure(font, "a")
+    cache.measure(font, "c")
+    assert font.calls == 3
+    cache.measure(font, "a")
+    assert font.calls == 3
+    cache.measure(font, "b")
+    assert font.calls == 4
+
+
+class KerningFont(CountingFont):
+    """A font that kerns a few pairs of characters, as Tk fonts do."""
+
+    KERNS = {"Te": 2, "AV": 3, "fi": 1}
+
+    def measure(self, text: str) -> int:
+        self.calls += 1
+        width = sum(6 + ord(c) % 5 for c in text)
+        for pair, kern in self.KERNS.items():
+            width -= kern * text.count(pair)
+        return width
+
+
+class SubpixelFont(CountingFont):
+    """A font whose advances are fractional, rounded once per string."""
+
+    def measure(self, text: str) -> int:
+        self.calls += 1
+        return round(sum(6.4 + 0.3 * (ord(c) % 5) for c in text))
+
+
+TEXTS = LOREM_IPSUM.split() + ["Tea", "TeTeTe", "AVAVAV", "fifififi", "Tex fix"]
+
+
+def test_glyph_measurer_slack_from_kerning():
+    approx = GlyphMeasurer()
+    font = KerningFont("font1")
+    assert approx.slack(font, 1) == 3 + 1 / len(CALIBRATION_TEXT)
+    assert MeasureCache().slack(font, 100) == 0
+
+
+@pytest.mark.parametrize("font", [KerningFont("font1"), SubpixelFont("font2")])
+def test_glyph_measurer_deviation_is_bounded(font):
+    assert_deviation_is_bounded(GlyphMeasurer(), font)
+
+
+def test_glyph_measurer_deviation_is_bounded_for_backend(fonts):
+    approx = GlyphMeasurer()
+    for family in ("Times", "Courier New"):
+        for bold, italic in itertools.product([False, True], repeat=2):
+            font = fonts.get_font(family, 14, bold, italic)
+            assert_deviation_is_bounded(approx, font)
+
+
+def assert_deviation_is_bounded(approx: GlyphMeasurer, font):
+    for text in TEXTS + [LOREM_IPSUM]:
+        deviation = abs(approx.measure(font, text) - font.measure(text))
+        assert deviation <= approx.slack(font, len(text))
+
+
+def test_glyph_measurer_measures_each_character_once():
+    approx = GlyphMeasurer()
+    font = CountingFont("font1")
+    words = LOREM_IPSUM.split()
+    widths = [approx.measure(font, word) for word in words]
+    assert widths == [10 * len(word) for word in words]
+    assert font.calls == len(set("".join(words)))
+    assert approx.measure_exact(font, "lorem") == 50
+
+
 # def test_soft_hyphens(_setup_tkinter):
 #     width = 100
 #     nodes = Text("supercalifragilis\N{SOFT HYPHEN}ticexpialidocious")
@@ -160,5 +426,14 @@ def treeify(parent: Node, children: Node | List[Node]) -> Node:
     return parent
 
 
+def break_lines(measurer: MeasureCache, fonts: FontBackend) -> List[List[str]]:
+    """Lays out a few paragraphs of text, returning the words on each line."""
+    node = Text(LOREM_IPSUM * 5)
+    style(node)
+    root = DocumentLayout(node, 300, measurer=measurer, fonts=fonts)
+    root.layout()
+    return [[t.word for t in line.children] for line in root.children[0].children]
+
+
 def get_text_layout(root: DocumentLayout, line_index: int, text_index: int) -> TextLayout:
     return root.children[0].children[line_index].children[text_index]
\ No newline at end of file
@@ -1,12 +1,34 @@
+import asyncio
+import gzip
+import json
 import os
 import socketserver
 import threading
 import time
+from email.utils import formatdate
 from http.server import SimpleHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 
-from giraffe.net import URL, Scheme
+from giraffe.net import (
+    MAX_JOURNAL_ENTRIES,
+    MAX_PENDING_ACCESSES,
+    POOL,
+    URL,
+    READ_LINE,
+    BodyDecoder,
+    BodyFraming,
+    ConnectionPool,
+    DiskCache,
+    HttpCache,
+    Response,
+    Scheme,
+    _http_exchange,
+    async_pool,
+    fetch_all,
+    fetch_all_async,
+)
 
 """Test cases for the browser's net code.
 
@@ -32,6 +54,66 @@ def test_server():
     httpd.shutdown()
 
 
+class KeepAliveHandler(SimpleHTTPRequestHandler):
+    """Serves files over HTTP/1.1.
+
+    A `cc` query is echoed back as Cache-Control, a `sleep` query delays
+    the response by that many seconds and an `encode` query sends the file
+    gzipped in chunks of that many bytes.
+    """
+
+    protocol_version = "HTTP/1.1"
+    requests = 0
+    last_headers = None
+
+    def do_GET(self):
+        KeepAliveHandler.requests += 1
+        KeepAliveHandler.last_headers = self.headers
+        query = parse_qs(urlsplit(self.path).query)
+        for delay in query.get("sleep", []):
+            time.sleep(float(delay))
+        if "encode" in query:
+            self.send_encoded(int(query["encode"][0]))
+        else:
+            super().do_GET()
+
+    def send_encoded(self, chunk_size: int):
+        with open(self.translate_path(self.path), "rb") as f:
+            body = gzip.compress(f.read())
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(body), chunk_size):
+            chunk = body[i : i + chunk_size]
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def end_headers(self):
+        query = parse_qs(urlsplit(self.path).query)
+        for cc in query.get("cc", []):
+            self.send_header("Cache-Control", cc)
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingTestServer(socketserver.ThreadingMixIn, TestServer):
+    daemon_threads = True
+
+
+@pytest.fixture(scope="module")
+def keep_alive_server():
+    httpd = ThreadingTestServer(("", 8890), KeepAliveHandler)
+    httpd_thread = threading.Thread(target=httpd.serve_forever)
+    httpd_thread.daemon = True
+    httpd_thread.start()
+    yield httpd
+    httpd.shutdown()
+
+
 def test_nonexistent_scheme():
     with pytest.raises(KeyError):
         URL("foo://bar/quux")
@@ -86,6 +168,7 @@ def test_url_with_data_nocomma():
 def test_request_response(test_server):
     raw_url = "http://localhost:8888/data/index.html"
     url = URL(raw_url)
+    before = POOL.stats()
 
     response = url.request_response()
     assert response.version == "HTTP/1.0"
@@ -93,7 +176,53 @@ def test_request_response(test_server):
     assert response.explanation == "OK\r\n"
     assert response.headers["content-type"] == "text/html"
     assert response.body == "<html>hi</html>"
-    assert url.num_sockets() == 1
+    after = POOL.stats()
+    assert after.misses == before.misses + 1
+    # HTTP/1.0 responses close the connection, so nothing is left pooled
+    assert after.open_sockets == before.open_sockets
+
+
+def test_pool_reuses_keep_alive_socket(keep_alive_server):
+    POOL.clear()
+    before = POOL.stats()
+    page = URL("http://localhost:8890/data/index.html")
+    assert page.request() == "<html>hi</html>"
+    css = page.resolve("book.css")
+    assert "pre" in css.request()
+
+    after = POOL.stats()
+    assert after.misses == before.misses + 1
+    assert after.hits == before.hits + 1
+    assert after.open_sockets == 1
+
+
+def test_pool_drops_dead_socket(keep_alive_server):
+    pool = ConnectionPool()
+    key = (Scheme.HTTP, "localhost", 8890)
+    s, reused = pool.acquire(key)
+    assert not reused
+    pool.release(key, s)
+    s.close()
+
+    s, reused = pool.acquire(key)
+    assert not reused
+    assert pool.stats().misses == 2
+    pool.release(key, s, reuse=False)
+    assert pool.stats().open_sockets == 0
+
+
+def test_pool_evicts_idle_sockets(keep_alive_server):
+    pool = ConnectionPool(idle_timeout=0)
+    key = (Scheme.HTTP, "localhost", 8890)
+    s, _ = pool.acquire(key)
+    pool.release(key, s)
+    time.sleep(0.01)
+
+    s, reused = pool.acquire(key)
+    assert not reused
+    pool.release(key, s)
+    pool.clear()
+    assert pool.stats().open_sockets == 0
 
 
 def test_request(test_server):
@@ -104,6 +233,64 @@ def test_request(test_server):
     assert content == "<html>hi</html>"
 
 
+def test_request_response_async(test_server):
+    url = URL("http://localhost:8888/data/index.html")
+
+    response = asyncio.run(url.request_response_async(HttpCache()))
+    assert response.version == "HTTP/1.0"
+    assert response.status == "200"
+    assert response.headers["content-type"] == "text/html"
+    assert response.body == "<html>hi</html>"
+
+
+def test_request_async_local_schemes():
+    url = URL("data:text/html,Hello world!")
+    assert asyncio.run(url.request_async()) == "Hello world!"
+
+
+def test_request_chunked_gzip(keep_alive_server):
+    url = URL("http://localhost:8890/data/book.css?encode=1000")
+    with open("data/book.css") as f:
+        expected = f.read()
+    assert url.request(HttpCache()) == expected
+    assert asyncio.run(url.request_async(HttpCache())) == expected
+
+
+def test_async_pool_reuses_streams(keep_alive_server):
+    async def fetch_twice():
+        page = URL("http://localhost:8890/data/index.html")
+        first = await page.request_async(HttpCache())
+        second = await page.resolve("book.css").request_async(HttpCache())
+        stats = async_pool().stats()
+        async_pool().clear()
+        return first, second, stats
+
+    first, second, stats = asyncio.run(fetch_twice())
+    assert first == "<html>hi</html>"
+    assert "pre" in second
+    assert stats.misses == 1
+    assert stats.hits == 1
+
+
+def test_fetch_all_async(keep_alive_server):
+    urls = [
+        URL("http://localhost:8890/data/book.css?sleep=0.2"),
+        URL("http://localhost:8890/data/index.html?sleep=2"),
+        URL("http://localhost:8890/data/index.html"),
+    ]
+
+    async def fetch():
+        bodies = await fetch_all_async(urls, HttpCache(), budget=0.5)
+        async_pool().clear()
+        return bodies
+
+    start = time.monotonic()
+    bodies = asyncio.run(fetch())
+    assert time.monotonic() - start < 1.5
+    assert "pre" in bodies[0]
+    assert bodies[1:] == [None, "<html>hi</html>"]
+
+
 @pytest.mark.slow
 def test_request_headers():
     raw_url = "https://httpbin.org/headers"
@@ -274,3 +461,448 @@ def test_url_str_https_default_port():
 def test_url_str_data():
     url = URL("data:text/html,Hello world!")
     assert str(url) == "data:text/html,Hello world!"
+
+
+def make_response(cache_control: str | None = None, body="hi", **headers):
+    if cache_control is not None:
+        headers["cache-control"] = cache_control
+    return Response("HTTP/1.1", "200", "OK", headers, body)
+
+
+def test_cache_hit():
+    cache = HttpCache()
+    response = make_response("max-age=60")
+    cache.put("http://a/", response, request_time=0, response_time=0)
+    assert cache.get("http://a/", now=30) is response
+    assert cache.get("http://a/", now=61) is None
+    assert cache.stats().hits == 1
+    assert cache.stats().misses == 1
+
+
+def test_cache_no_store():
+    cache = HttpCache()
+    cache.put("http://a/", make_response("no-store, max-age=60"), 0, 0)
+    assert cache.get("http://a/", now=1) is None
+    assert cache.stats().entries == 0
+
+
+def test_cache_no_cache():
+    cache = HttpCache()
+    cache.put("http://a/", make_response("no-cache, max-age=60"), 0, 0)
+    assert cache.get("http://a/", now=1) is None
+
+
+def test_cache_private():
+    response = make_response("private, max-age=60")
+    private = HttpCache()
+    private.put("http://a/", response, 0, 0)
+    assert private.get("http://a/", now=1) is response
+
+    shared = HttpCache(shared=True)
+    shared.put("http://a/", response, 0, 0)
+    assert shared.get("http://a/", now=1) is None
+
+
+def test_cache_age_header():
+    cache = HttpCache()
+    cache.put("http://a/", make_response("max-age=60", age="50"), 0, 0)
+    assert cache.get("http://a/", now=5) is not None
+    assert cache.get("http://a/", now=11) is None
+
+
+def test_cache_date_header():
+    cache = HttpCache()
+    response = make_response("max-age=60", date=formatdate(1000, usegmt=True))
+    cache.put("http://a/", response, request_time=1030, response_time=1030)
+    assert cache.get("http://a/", now=1050) is not None
+    assert cache.get("http://a/", now=1061) is None
+
+
+def test_cache_expires_header():
+    cache = HttpCache()
+    response = make_response(
+        date=formatdate(1000, usegmt=True), expires=formatdate(1060, usegmt=True)
+    )
+    cache.put("http://a/", response, 1000, 1000)
+    assert cache.get("http://a/", now=1059) is not None
+    assert cache.get("http://a/", now=1061) is None
+
+
+def test_cache_lru_eviction():
+    first = make_response("max-age=60", body="a" * 100)
+    sizing = HttpCache()
+    sizing.put("http://a/", first, 0, 0)
+    entry_size = sizing.stats().size
+
+    cache = HttpCache(max_bytes=2 * entry_size)
+    cache.put("http://a/", first, 0, 0)
+    cache.put("http://b/", make_response("max-age=60", body="b" * 100), 0, 0)
+    assert cache.get("http://a/", now=1) is first
+    cache.put("http://c/", make_response("max-age=60", body="c" * 100), 0, 0)
+    assert cache.get("http://a/", now=1) is first
+    assert cache.get("http://b/", now=1) is None
+    assert cache.stats().size <= 2 * entry_size
+
+
+def test_cache_skips_oversized():
+    cache = HttpCache(max_bytes=10)
+    cache.put("http://a/", make_response("max-age=60", body="a" * 100), 0, 0)
+    assert cache.stats().entries == 0
+
+
+def test_cache_shared_across_requests(keep_alive_server):
+    cache = HttpCache()
+    raw_url = "http://localhost:8890/data/book.css?cc=max-age%3D60"
+    first = URL(raw_url).request_response(cache)
+    requests = KeepAliveHandler.requests
+    second = URL(raw_url).request_response(cache)
+    assert first is second
+    assert KeepAliveHandler.requests == requests
+
+
+def test_disk_cache_survives_restart(tmp_path):
+    response = make_response("max-age=60", body="<html>cached</html>")
+    HttpCache(disk=DiskCache(str(tmp_path))).put("http://a/", response, 0, 0)
+
+    cache = HttpCache(disk=DiskCache(str(tmp_path)))
+    restored = cache.get("http://a/", now=1)
+    assert restored is not None
+    assert restored.body == "<html>cached</html>"
+    assert restored.headers["cache-control"] == "max-age=60"
+    assert cache.stats().disk_hits == 1
+    assert cache.get("http://a/", now=2) is restored
+    assert cache.stats().hits == 1
+
+
+def test_disk_cache_read_outside_lock(tmp_path):
+    reading, done = threading.Event(), threading.Event()
+
+    class SlowDisk(DiskCache):
+        def get(self, *args, **kwargs):
+            reading.set()
+            done.wait(5)
+            return super().get(*args, **kwargs)
+
+    cache = HttpCache(disk=SlowDisk(str(tmp_path)))
+    cache.put("http://a/", make_response("max-age=60"), 0, 0)
+    thread = threading.Thread(target=cache.get, args=("http://b/", 1))
+    thread.start()
+    assert reading.wait(5)
+    assert cache.get("http://a/", now=1) is not None
+    done.set()
+    thread.join()
+    assert cache.stats().misses == 1
+
+
+def test_disk_cache_cleared_with_memory(tmp_path):
+    cache = HttpCache(disk=DiskCache(str(tmp_path)))
+    cache.put("http://a/", make_response("max-age=60"), 0, 0)
+    cache.clear()
+    assert cache.get("http://a/", now=1) is None
+    assert len(cache.disk) == 0
+
+
+def test_disk_cache_skips_stale(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    HttpCache(disk=disk).put("http://a/", make_response("max-age=60"), 0, 0)
+    assert disk.get("http://a/", now=61) is None
+
+
+def test_disk_cache_empty_body(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    HttpCache(disk=disk).put("http://a/", make_response("max-age=60", body=""), 0, 0)
+    entry = disk.get("http://a/", now=1)
+    assert entry is not None
+    assert entry.response.body == ""
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=250)
+    cache = HttpCache(disk=disk)
+    cache.put("http://a/", make_response("max-age=60", body="a" * 100), 0, 0)
+    cache.put("http://b/", make_response("max-age=60", body="b" * 100), 0, 1)
+    assert disk.get("http://a/", now=2) is not None
+    cache.put("http://c/", make_response("max-age=60", body="c" * 100), 0, 3)
+    assert len(disk) == 2
+    assert disk.size == 200
+    assert disk.get("http://b/", now=4) is None
+    blobs = set(os.listdir(tmp_path)) - {DiskCache.INDEX, DiskCache.JOURNAL}
+    assert len(blobs) == 2
+
+
+def test_disk_cache_persists_last_access(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=250)
+    cache = HttpCache(disk=disk)
+    cache.put("http://a/", make_response("max-age=60", body="a" * 100), 0, 0)
+    cache.put("http://b/", make_response("max-age=60", body="b" * 100), 0, 1)
+    assert disk.get("http://a/", now=2) is not None
+    cache.flush()
+
+    disk = DiskCache(str(tmp_path), max_bytes=250)
+    HttpCache(disk=disk).put(
+        "http://c/", make_response("max-age=60", body="c" * 100), 0, 3
+    )
+    assert disk.get("http://a/", now=4) is not None
+    assert disk.get("http://b/", now=4) is None
+
+
+def test_disk_cache_journals_accesses(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    cache = HttpCache(disk=disk)
+    for i in range(MAX_PENDING_ACCESSES):
+        cache.put(f"http://{i}/", make_response("max-age=60"), 0, 0)
+    for i in range(MAX_PENDING_ACCESSES):
+        disk.get(f"http://{i}/", now=5)
+
+    restored = DiskCache(str(tmp_path))
+    assert restored._index["http://0/"]["last_access"] == 5
+
+
+def test_disk_cache_removes_unstorable(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    cache = HttpCache(disk=disk)
+    cache.put("http://a/", make_response("max-age=60"), 0, 0)
+    cache.put("http://a/", make_response("no-store"), 0, 0)
+    assert len(disk) == 0
+
+
+def test_disk_cache_journals_changes(tmp_path, monkeypatch):
+    disk = DiskCache(str(tmp_path))
+    cache = HttpCache(disk=disk)
+    cache.put("http://a/", make_response("max-age=60", body="a"), 0, 0)
+    index = os.path.join(tmp_path, DiskCache.INDEX)
+    assert not os.path.exists(index)
+
+    saves = []
+    monkeypatch.setattr(disk, "_save_index", lambda: saves.append(1))
+    for _ in range(200):
+        cache.put("http://b/", make_response("no-store"), 0, 0)
+    assert saves == []
+
+    restored = DiskCache(str(tmp_path))
+    assert len(restored) == 1
+    assert restored.size == 1
+
+
+def test_disk_cache_folds_journal_into_index(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    cache = HttpCache(disk=disk)
+    for i in range(MAX_JOURNAL_ENTRIES + 1):
+        cache.put(f"http://{i}/", make_response("max-age=60"), 0, 0)
+    with open(os.path.join(tmp_path, DiskCache.INDEX)) as f:
+        assert len(json.load(f)) == MAX_JOURNAL_ENTRIES + 1
+    cache.put("http://0/", make_response("no-store"), 0, 0)
+    disk.flush()
+    assert os.path.getsize(os.path.join(tmp_path, DiskCache.JOURNAL)) == 0
+    assert len(DiskCache(str(tmp_path))) == MAX_JOURNAL_ENTRIES
+
+
+def test_cache_keeps_revalidatable():
+    cache = HttpCache()
+    response = make_response("no-cache", etag='"v1"')
+    cache.put("http://a/", response, 0, 0)
+    assert cache.get("http://a/", now=1) is None
+    stale = cache.get_stale("http://a/", now=1)
+    assert stale is not None
+    assert stale.conditional_headers() == {"If-None-Match": '"v1"'}
+
+
+def test_cache_refresh_not_modified():
+    cache = HttpCache()
+    response = make_response("max-age=10", etag='"v1"', **{"content-length": "2"})
+    cache.put("http://a/", response, 0, 0)
+    stale = cache.get_stale("http://a/", now=20)
+    assert stale is not None
+
+    not_modified = Response(
+        "HTTP/1.1", "304", "Not Modified", {"cache-control": "max-age=60"}, ""
+    )
+    refreshed = cache.refresh("http://a/", stale, not_modified, 20, 20)
+    assert refreshed is response
+    assert refreshed.body == "hi"
+    assert refreshed.headers["content-length"] == "2"
+    assert cache.get("http://a/", now=70) is response
+    assert cache.stats().revalidations == 1
+
+
+def test_revalidates_with_last_modified(keep_alive_server):
+    cache = HttpCache()
+    raw_url = "http://localhost:8890/data/book.css?cc=no-cache"
+    first = URL(raw_url).request_response(cache)
+    assert first.status == "200"
+    assert "If-Modified-Since" not in KeepAliveHandler.last_headers
+
+    second = URL(raw_url).request_response(cache)
+    assert second is first
+    assert "pre" in second.body
+    headers = KeepAliveHandler.last_headers
+    assert headers["If-Modified-Since"] == first.headers["last-modified"]
+    assert cache.stats().revalidations == 1
+
+
+def test_stream_revalidation_reuses_socket(keep_alive_server):
+    cache = HttpCache()
+    url = URL("http://localhost:8890/data/book.css?cc=no-cache")
+    assert "pre" in "".join(url.stream(cache))
+    before = POOL.stats()
+
+    for _ in range(2):
+        assert "pre" in "".join(url.stream(cache))
+    after = POOL.stats()
+    assert cache.stats().revalidations == 2
+    assert after.hits == before.hits + 2
+    assert after.misses == before.misses
+
+
+def test_fetch_all_keeps_order(keep_alive_server):
+    urls = [
+        URL("http://localhost:8890/data/book.css?sleep=0.2"),
+        URL("http://localhost:8890/data/index.html"),
+        URL("data:text/html,inline"),
+    ]
+    bodies = fetch_all(urls, HttpCache())
+    assert "pre" in bodies[0]
+    assert bodies[1] == "<html>hi</html>"
+    assert bodies[2] == "inline"
+
+
+def test_fetch_all_budget(keep_alive_server):
+    urls = [
+        URL("http://localhost:8890/data/index.html?sleep=2"),
+        URL("http://localhost:8890/data/index.html"),
+    ]
+    start = time.monotonic()
+    bodies = fetch_all(urls, HttpCache(), budget=0.5)
+    assert time.monotonic() - start < 1.5
+    assert bodies == [None, "<html>hi</html>"]
+
+
+def test_fetch_all_timeout(keep_alive_server):
+    urls = [URL("http://localhost:8890/data/index.html?sleep=2")]
+    start = time.monotonic()
+    bodies = fetch_all(urls, HttpCache(), timeout=0.2)
+    assert time.monotonic() - start < 1.5
+    assert bodies == [None]
+
+
+def test_fetch_all_failure():
+    assert fetch_all([URL("file:///does/not/exist")]) == [None]
+
+
+def frame(response: Response, data: bytes, step: int) -> bytes:
+    framing = BodyFraming(response)
+    body = b""
+    while (size := framing.next_read()) is not None:
+        if size == READ_LINE:
+            line, data = data.split(b"\r\n", 1)
+            read = line + b"\r\n"
+        else:
+            read, data = data[: min(size, step)], data[min(size, step) :]
+        body += framing.feed(read)
+    assert data == b"next response"
+    return body
+
+
+@pytest.mark.parametrize("step", [1, 3, 1024])
+def test_body_framing(step):
+    chunked = Response(headers={"transfer-encoding": "chunked"})
+    data = b"5\r\nhello\r\n7\r\n, world\r\n0\r\n\r\nnext response"
+    assert frame(chunked, data, step) == b"hello, world"
+
+    sized = Response(headers={"content-length": "5"})
+    assert frame(sized, b"hellonext response", step) == b"hello"
+    not_modified = Response(status="304")
+    assert frame(not_modified, b"next response", step) == b""
+
+
+def test_body_framing_truncated():
+    framing = BodyFraming(Response(headers={"content-length": "5"}))
+    framing.feed(b"hel")
+    with pytest.raises(EOFError):
+        framing.feed(b"")
+
+
+def test_http_exchange_redirects_and_caches():
+    cache = HttpCache()
+    exchange = _http_exchange(URL("http://a/old"), cache)
+    url, headers = next(exchange)
+    assert str(url) == "http://a/old"
+    assert headers is None
+
+    moved = make_response("max-age=60", body="", location="/new")
+    moved.status = "301"
+    url, headers = exchange.send(moved)
+    assert str(url) == "http://a/new"
+    with pytest.raises(StopIteration) as done:
+        exchange.send(make_response("max-age=60", body="new"))
+    assert done.value.value.body == "new"
+
+    # both responses are cached now, so nothing has to be sent
+    with pytest.raises(StopIteration) as done:
+        next(_http_exchange(URL("http://a/old"), cache))
+    assert done.value.value.body == "new"
+
+
+def test_body_decoder_split_bytes():
+    text = "snow ⛄ smile 😀 " * 100
+    encoded = gzip.compress(text.encode("utf8")) + gzip.compress(b"!")
+    decoder = BodyDecoder(gzipped=True)
+    decoded = "".join(decoder.feed(encoded[i : i + 1]) for i in range(len(encoded)))
+    assert decoded + decoder.close() == text + "!"
+
+
+def test_body_decoder_truncated():
+    decoder = BodyDecoder(gzipped=True)
+    decoder.feed(gzip.compress(b"hello")[:-4])
+    with pytest.raises(EOFError):
+        decoder.close()
+
+
+def test_stream_chunked_gzip(keep_alive_server):
+    url = URL("http://localhost:8890/data/emoji.html?encode=7")
+    with open("data/emoji.html") as f:
+        expected = f.read()
+    chunks = list(url.stream(HttpCache()))
+    assert len(chunks) > 1
+    assert "".join(chunks) == expected
+
+
+def test_stream_fills_cache(keep_alive_server):
+    cache = HttpCache()
+    url = URL("http://localhost:8890/data/book.css?cc=max-age%3D60")
+    streamed = "".join(url.stream(cache))
+    requests = KeepAliveHandler.requests
+    assert "".join(url.stream(cache)) == streamed
+    assert url.request(cache) == streamed
+    assert KeepAliveHandler.requests == requests
+
+
+@pytest.mark.parametrize(
+    "max_bytes, cc",
+    [(2**20, "no-store"), (1024, "no-cache")],
+    ids=["unstorable", "oversized"],
+)
+def test_stream_drops_old_entry(keep_alive_server, max_bytes, cc):
+    cache = HttpCache(max_bytes=max_bytes)
+    url = URL(f"http://localhost:8890/data/book.css?cc={cc}")
+    cache.put(str(url), make_response("no-cache", body="old", etag='"v1"'), 0, 0)
+    assert cache.get_stale(str(url)) is not None
+
+    assert "pre" in "".join(url.stream(cache))
+    assert cache.get_stale(str(url)) is None
+    assert cache.stats().entries == 0
+
+
+def test_stream_abandoned_drops_socket(keep_alive_server):
+    POOL.clear()
+    before = POOL.stats().open_sockets
+    url = URL("http://localhost:8890/data/book.css?encode=100")
+    chunks = url.stream(HttpCache())
+    next(chunks)
+    assert POOL.stats().open_sockets == before + 1
+    chunks.close()
+    assert POOL.stats().open_sockets == before
+
+
+def test_stream_local_scheme():
+    assert list(URL("data:text/html,Hello world!").stream()) == ["Hello world!"]
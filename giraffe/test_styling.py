@@ -1,11 +1,26 @@
+from collections import Counter
+
 import pytest
 
-from giraffe.parser import Element, Text
+import giraffe.styling
+
+from giraffe.parser import ComputedStyle, Element, Text
 from giraffe.styling import (
     CSSParser,
     DescendantSelector,
     ParseError,
+    RuleIndex,
+    StylesheetCache,
+    StyleTable,
     TagSelector,
+    default_rule_index,
+    default_style_sheet,
+    invalidate_style,
+    merge_rules,
+    parse_inline_style,
+    restyle,
+    sharing_stats,
+    sort_rules,
     style,
 )
 
@@ -46,6 +61,29 @@ def test_literal_when_missing():
         parser.literal(":")
 
 
+def test_word_stops_at_underscore_and_punctuation():
+    parser = CSSParser("é1-#.%_x")
+    assert parser.word() == "é1-#.%"
+    assert parser.i == 6
+
+
+def test_ignore_until_end():
+    parser = CSSParser("abc")
+    assert parser.ignore_until([";", "}"]) is None
+    assert parser.i == 3
+
+
+def test_parse_recovers_from_bad_declarations():
+    css = "p { color: red; bad rule; font-size: 12px; } :x { a: b; } div  i {x:1}"
+    rules = CSSParser(css).parse()
+    assert [r.body for r in rules] == [
+        {"color": "red", "font-size": "12px"},
+        {"x": "1"},
+    ]
+    assert isinstance(rules[1].selector, DescendantSelector)
+    assert rules[1].cascade_priority() == 2
+
+
 def test_pair():
     parser = CSSParser("background-color:lightblue")
     assert parser.pair() == ("background-color", "lightblue")
@@ -93,6 +131,225 @@ def test_style_with_element_children():
     assert "background-color" in el.style
 
 
+def test_style_is_interned():
+    parent = Element("body")
+    for _ in range(3):
+        parent.children.append(Text("hi", parent))
+    style(parent)
+    first, second, third = parent.children
+    assert isinstance(first.style, ComputedStyle)
+    assert first.style is second.style is third.style
+
+
+def test_computed_style_is_immutable():
+    el = Element("div", attributes={"style": "color:red;"})
+    style(el)
+    assert el.style["color"] == "red"
+    with pytest.raises(TypeError):
+        el.style["color"] = "blue"  # type: ignore[index]
+
+
+def test_style_table_stats():
+    table = StyleTable()
+    a = table.intern({"color": "red", "font-size": "16px"})
+    b = table.intern({"font-size": "16px", "color": "red"})
+    c = table.intern({"color": "blue", "font-size": "16px"})
+    assert a is b
+    assert a is not c
+    assert a == ComputedStyle({"color": "red", "font-size": "16px"})
+    assert hash(a) == hash(ComputedStyle(dict(a)))
+    stats = table.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 2, 2)
+    assert stats.hit_rate == pytest.approx(1 / 3)
+
+
+def test_style_table_drops_unused_styles():
+    table = StyleTable()
+    table.intern({"color": "red"})
+    assert table.stats().size == 0
+
+
+def test_rule_index_candidates():
+    css = "div p { color: red; } p { color: blue; } b { color: green; }"
+    rules = CSSParser(css).parse()
+    index = RuleIndex(rules)
+    p = Element("p")
+    assert [r.selector for r in index.candidates(p)] == [
+        TagSelector("p"),
+        rules[0].selector,
+    ]
+    assert index.candidates(Element("span")) == []
+    assert index.candidates(Text("hi")) == []
+
+
+def test_style_with_rule_index_matches_list():
+    css = "p { color: blue; } div p { color: red; } i { font-style: x; }"
+    rules = CSSParser(css).parse()
+    rules.sort(key=lambda r: r.cascade_priority())
+    for rule_set in (rules, RuleIndex(rules)):
+        body = Element("body")
+        div = Element("div", parent=body)
+        p = Element("p", parent=div)
+        body.children.append(div)
+        div.children.append(p)
+        style(body, rule_set)
+        assert p.style["color"] == "red"
+
+
+def test_style_shared_between_siblings():
+    before = sharing_stats()
+    ul = Element("ul")
+    for inline in (None, None, "color:red", "color:red", None):
+        attributes = {"style": inline} if inline else None
+        ul.children.append(Element("li", attributes, parent=ul))
+    style(ul)
+    first, second, third, fourth, fifth = ul.children
+    assert first.style is second.style is fifth.style
+    assert third.style is fourth.style
+    assert third.style["color"] == "red"
+    assert first.style["color"] == "black"
+    after = sharing_stats()
+    assert after.hits - before.hits == 3
+    assert after.misses - before.misses == 2
+
+
+def test_style_sharing_is_scoped_to_parent():
+    rules = CSSParser("section p { color: red; }").parse()
+    body = Element("body")
+    section = Element("section", parent=body)
+    div = Element("div", parent=body)
+    body.children.extend([section, div])
+    section.children.append(Element("p", parent=section))
+    div.children.append(Element("p", parent=div))
+    style(body, RuleIndex(rules))
+    assert section.children[0].style["color"] == "red"
+    assert div.children[0].style["color"] == "black"
+
+
+def test_stylesheet_cache_parses_once():
+    cache = StylesheetCache()
+    css = "div p { color: red; } p { color: blue; }"
+    first = cache.parse("http://example.org/a.css", css)
+    second = cache.parse("http://example.org/a.css", css)
+    assert first is second
+    assert [r.cascade_priority() for r in first] == [1, 2]
+    changed = cache.parse("http://example.org/a.css", css + " b { color: x; }")
+    assert changed is not first
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 2, 2)
+
+
+def test_stylesheet_cache_evicts_least_recently_used():
+    cache = StylesheetCache(max_entries=2)
+    a = cache.parse("a.css", "p { color: red; }")
+    cache.parse("b.css", "p { color: red; }")
+    assert cache.parse("a.css", "p { color: red; }") is a
+    cache.parse("c.css", "p { color: red; }")
+    assert cache.stats().size == 2
+    assert cache.parse("a.css", "p { color: red; }") is a
+    assert cache.stats().misses == 3
+    cache.parse("b.css", "p { color: red; }")
+    assert cache.stats().misses == 4
+
+
+def test_merge_rules_matches_sort():
+    first = CSSParser("div p { color: red; } p { color: blue; } b { x: 1; }").parse()
+    second = CSSParser("p { color: green; } ul li { color: gray; }").parse()
+    merged = merge_rules(sort_rules(first), sort_rules(second))
+    assert merged == sort_rules(first + second)
+
+
+def test_parse_inline_style_is_shared():
+    first = parse_inline_style("color:red; font-size: 12px")
+    second = parse_inline_style("color:red; font-size: 12px")
+    assert first is second
+    assert dict(first) == {"color": "red", "font-size": "12px"}
+    with pytest.raises(TypeError):
+        first["color"] = "blue"  # type: ignore[index]
+
+
+def test_default_style_sheet_independent_of_cwd(tmp_path, monkeypatch):
+    default_style_sheet.cache_clear()
+    default_rule_index.cache_clear()
+    monkeypatch.chdir(tmp_path)
+    rules = default_style_sheet()
+    assert rules
+    assert list(rules) == sort_rules(rules)
+    assert default_style_sheet() is rules
+    pre = Element("pre")
+    style(pre)
+    assert pre.style["background-color"] == "gray"
+
+
+@pytest.fixture
+def tree():
+    body = Element("body")
+    div = Element("div", parent=body)
+    p = Element("p", parent=div)
+    section = Element("section", parent=body)
+    body.children.extend([div, section])
+    div.children.append(p)
+    p.children.append(Text("hi", parent=p))
+    style(body)
+    return body, div, p, section
+
+
+@pytest.fixture
+def computed(monkeypatch):
+    """Records the nodes whose style gets recomputed from here on."""
+    seen = []
+    compute_style = giraffe.styling.compute_style
+
+    def recording(node, rules, ancestors):
+        seen.append(node)
+        return compute_style(node, rules, ancestors)
+
+    monkeypatch.setattr(giraffe.styling, "compute_style", recording)
+    return seen
+
+
+def test_restyle_clean_tree_does_nothing(tree, computed):
+    body, _, _, _ = tree
+    restyle(body)
+    assert computed == []
+
+
+def test_restyle_after_set_attribute(tree, computed):
+    body, div, p, section = tree
+    div.set_attribute("style", "color:red")
+    restyle(body)
+    assert computed == [div, p, p.children[0]]
+    assert p.children[0].style["color"] == "red"
+    assert section.style["color"] == "black"
+
+
+def test_restyle_stops_when_style_unchanged(tree, computed):
+    body, div, p, _ = tree
+    div.set_attribute("id", "main")
+    restyle(body)
+    assert computed == [div]
+    assert div.attributes == {"id": "main"}
+
+
+def test_restyle_after_append_child(tree, computed):
+    body, _, _, section = tree
+    em = Element("em")
+    em.children.append(Text("new", parent=em))
+    section.append_child(em)
+    restyle(body)
+    assert computed == [em, em.children[0]]
+    assert em.parent is section
+
+
+def test_invalidate_style_marks_matching_tags(tree, computed):
+    body, div, p, section = tree
+    rules = CSSParser("section p { color: red; } p { font-weight: bold; }").parse()
+    invalidate_style(body, rules)
+    restyle(body, RuleIndex(rules))
+    assert computed == [p, p.children[0]]
+    assert p.style["font-weight"] == "bold"
+
+
 def test_tag_selector_matches():
     selector = TagSelector("div")
     div = Element("div")
@@ -129,6 +386,35 @@ def test_descendant_selector_no_match():
     assert not selector.matches(el)
 
 
+def test_descendant_selector_ancestor_tags():
+    selector = CSSParser("html body div { color: red; }").parse()[0].selector
+    assert isinstance(selector, DescendantSelector)
+    assert selector.ancestor_tags == {"html", "body"}
+
+
+def test_descendant_selector_rejects_with_ancestors():
+    selector = DescendantSelector(TagSelector("body"), TagSelector("div"))
+    parent = Element("body")
+    el = Element("div", parent=parent)
+    parent.children.append(el)
+    assert selector.matches(el, Counter({"body": 1}))
+    # The counts are trusted over the tree, so no walk happens here.
+    assert not selector.matches(el, Counter({"html": 1}))
+    assert not selector.matches(el, Counter({"body": 0}))
+
+
+def test_style_tracks_ancestors_from_subtree():
+    rules = CSSParser("section p { color: red; }").parse()
+    section = Element("section")
+    div = Element("div", parent=section)
+    p = Element("p", parent=div)
+    section.children.append(div)
+    div.children.append(p)
+    style(section)
+    style(div, RuleIndex(rules))
+    assert p.style["color"] == "red"
+
+
 def test_descendant_selector_with_grandparent():
     ancestor = TagSelector("body")
     descendant = TagSelector("p")